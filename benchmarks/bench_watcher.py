@@ -0,0 +1,374 @@
+"""
+Benchmarks the CUSUM watcher's hot path offline.
+
+Builds a synthetic tape (N markets, random-walk prices at a fixed trade rate) and a synthetic
+watchlist (M users, each watching a mix of tick/volume/dollar aggregations), stubs out ftx, mongo
+and telegram, and steps a real CUSUM through the tape on a simulated clock. Each phase of the
+main loop is timed every cycle, and the engine (trickle) is timed on its own and reported apart
+from the cycle total. A second pass under tracemalloc records what each phase allocates. Nothing
+goes over the network - crash reports are kept by a stand-in dispatcher and counted. Results are
+printed (or written with --out) as json so runs can be diffed.
+
+    python -m benchmarks.bench_watcher --markets 50 --users 200 --cycles 30
+
+"""
+
+import argparse
+import functools
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import common.connection
+import watcher.cusum
+from watcher.cusum import CUSUM
+from watcher.engine import trickle
+
+# the main loop's phases, timed every cycle
+PHASES = [
+    "update_cache",
+    "update_counts",
+    "send_pings",
+    "update_cache_stats",
+    "update_mongo_watchlist",
+]
+
+
+def make_tape(markets, seconds, rate, start, seed=0):
+    """
+    a synthetic tape per market: `rate` trades a second for `seconds` from start (epoch s)
+    returns {market: (rows, times)} - the ftx rows oldest first and their times in epoch ms
+    """
+    rng = np.random.default_rng(seed)
+    tape = {}
+    next_id = 1
+    for i, market in enumerate(markets):
+        n = int(seconds * rate)
+        times = np.sort(start * 1e9 + rng.random(n) * seconds * 1e9).astype(np.int64)
+        prices = np.round((10 + i) * np.exp(np.cumsum(rng.normal(0, 0.002, n))), 4)
+        sizes = np.round(rng.exponential(2.0, n), 4)
+        sides = np.where(rng.random(n) < 0.5, "buy", "sell")
+        stamps = pd.to_datetime(times, utc=True).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+        rows = [
+            {
+                "id": next_id + j,
+                "liquidation": False,
+                "price": price,
+                "side": side,
+                "size": size,
+                "time": stamp,
+            }
+            for j, (price, side, size, stamp) in enumerate(
+                zip(prices.tolist(), sides.tolist(), sizes.tolist(), stamps)
+            )
+        ]
+        next_id += n
+        tape[market] = (rows, times / 1e6)
+    return tape
+
+
+def make_watchlist(markets, users, aggs, seed=0):
+    """M watchList documents, each user watching `aggs` random aggregations over the markets"""
+    rng = np.random.default_rng(seed + 1)
+    units = {"tick": [10, 50, 200], "volume": [20, 100, 500], "dollar": [500, 2500, 10000]}
+    percs = [0.2, 0.5, 1, 2]
+    docs = []
+    for user in range(users):
+        watching = {}
+        for _ in range(aggs):
+            agg_type = ["tick", "volume", "dollar"][rng.integers(3)]
+            agg = "{}_{}_{}".format(
+                agg_type,
+                units[agg_type][rng.integers(3)],
+                percs[rng.integers(len(percs))],
+            )
+            watching.setdefault(markets[rng.integers(len(markets))], set()).add(agg)
+        docs.append(
+            {
+                "_id": user,
+                "TGUsername": "user{}".format(user),
+                "TGChatID": 1000 + user,
+                "watchList": [
+                    {"market": market, "aggs": sorted(aggs)} for market, aggs in watching.items()
+                ],
+            }
+        )
+    return docs
+
+
+class Collection:
+    """just enough of a pymongo collection for the watcher"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query={}):
+        return [doc for doc in self.docs if all(doc.get(k) == v for k, v in query.items())]
+
+
+class Database(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+class FakeDispatcher:
+    """stands in for the telegram dispatcher, keeping what it was given (crash reports)"""
+
+    def __init__(self, token, api=None, **kwargs):
+        self.messages = []
+
+    def submit(self, chat_id, text, on_done=None):
+        self.messages.append((chat_id, text))
+        if on_done is not None:
+            on_done(True)
+
+    def flush(self, timeout=None):
+        return True
+
+    def close(self, timeout=None):
+        pass
+
+
+class SimClock(datetime):
+    """a datetime whose now() is the simulated clock"""
+
+    ts = 0.0
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.fromtimestamp(cls.ts, tz)
+
+
+class BenchWatcher(CUSUM):
+    def __init__(self, tape, **kwargs):
+        self.tape = tape
+        # the tape's exchange times are years behind our clock, so every alert would look slow
+        super().__init__(checkpoint=None, slow_alert=None, **kwargs)
+
+    def fetch_trades(self, symbol, since=None, until=None, limit=None, params={}, raw=False):
+        """serves the tape's rows in [since, until] newest first, like ftx does"""
+        rows, times = self.tape[symbol]
+        until = SimClock.ts * 1000 if until is None else until
+        lo = 0 if since is None else int(np.searchsorted(times, since, side="left"))
+        hi = int(np.searchsorted(times, until, side="right"))
+        if limit is not None:
+            lo = max(lo, hi - limit)
+        return rows[lo:hi][::-1]
+
+    def load_markets(self, reload=False, params={}):
+        """offline - the tape's symbols are used as they are"""
+        return {}
+
+    def throttle(self, cost=None):
+        """offline - no rate limit to respect"""
+        pass
+
+    def trickle_all(self):
+        """the engine on every group with the cache as is, without writing the results back"""
+        counter = self.counter
+        for (market, agg_type), rows in counter.groups().items():
+            trickle(
+                self.cache[market]["cum"][agg_type],
+                self.cache[market]["txs"]["price"],
+                counter.count[rows],
+                counter.cusum_count[rows],
+                counter.last_agg_price[rows],
+                counter.agg_unit[rows],
+                counter.agg_perc[rows],
+                self.cache[market].get("last_price"),
+            )
+
+
+def install_stubs(markets, watchlist, sent):
+    """points the watcher's mongo, clock and telegram at in-memory stand-ins"""
+    levels = [str(x) for x in range(0, 5000, 5)]
+    common.connection.connections["mongo"] = {
+        "cusum": Database(watchList=Collection(watchlist)),
+        "archive": Database(
+            keyPriceLevels=Collection(
+                [
+                    {"_id": i, "name": market.split("/")[0], "levels": levels}
+                    for i, market in enumerate(markets)
+                ]
+            )
+        ),
+    }
+    watcher.cusum.datetime = SimClock
+    watcher.cusum.Dispatcher = FakeDispatcher
+    watcher.cusum.send_notif = functools.partial(fake_send, sent=sent)
+
+
+def fake_send(registry, dispatcher=None, on_done=None, sent=None):
+    """counts the messages and reports each one delivered"""
+    sent.append(len(registry))
+    if on_done is not None:
+        for id in registry:
+            on_done(id, True)
+
+
+def run_cycle(bench, interval, timings=None, memory=None):
+    """
+    one pass of the main loop (less the log output), phase by phase. The engine is also run on
+    its own (trickle) before the counts are updated - it's timed but isn't part of the loop
+    """
+    SimClock.ts += interval
+    calls = {
+        "update_cache": bench._update_cache,
+        "trickle": bench.trickle_all,
+        "update_counts": bench._update_counts,
+        "send_pings": bench._send_pings,
+        "update_cache_stats": bench._update_cache_stats,
+        "update_mongo_watchlist": bench._update_mongo_watchlist,
+    }
+    for phase in STEPS:
+        if memory is not None:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        began = time.perf_counter()
+        calls[phase]()
+        elapsed = time.perf_counter() - began
+        if timings is not None:
+            timings[phase].append(elapsed)
+        if memory is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            memory[phase].append((current - before, peak - before))
+    return (
+        sum(len(bench.cache[market]["txs"]) for market in bench.cache),
+        int(bench.counter.hit.sum()),
+    )
+
+
+STEPS = PHASES[:1] + ["trickle"] + PHASES[1:]
+
+
+def summarise(seconds):
+    seconds = np.array(seconds)
+    return {
+        "mean_ms": seconds.mean() * 1000,
+        "p50_ms": np.percentile(seconds, 50) * 1000,
+        "p95_ms": np.percentile(seconds, 95) * 1000,
+        "max_ms": seconds.max() * 1000,
+    }
+
+
+def bench(markets=20, users=100, aggs=4, rate=5.0, cycles=30, memory_cycles=5, interval=10):
+    names = ["C{}/USD".format(i) for i in range(markets)]
+    start = 1650000000
+    span = (cycles + memory_cycles + 2) * interval
+    tape = make_tape(names, span, rate, start)
+    watchlist = make_watchlist(names, users, aggs)
+    sent = []
+    install_stubs(names, watchlist, sent)
+
+    SimClock.ts = start + interval
+    began = time.perf_counter()
+    watcher = BenchWatcher(tape, interval=interval)
+    startup = time.perf_counter() - began
+    # the warm-up cycle run() does before counting
+    SimClock.ts += interval
+    watcher._update_cache()
+    watcher._update_cache_stats()
+
+    timings = {phase: [] for phase in STEPS}
+    trades = hits = 0
+    for _ in range(cycles):
+        new, hit = run_cycle(watcher, interval, timings=timings)
+        trades += new
+        hits += hit
+
+    memory = {phase: [] for phase in STEPS}
+    tracemalloc.start()
+    for _ in range(memory_cycles):
+        run_cycle(watcher, interval, memory=memory)
+    tracemalloc.stop()
+    # done with the watcher's files before its scratch directory goes
+    watcher.hitlog.close(timeout=10)
+    watcher.outbox.close()
+
+    phases = {}
+    for phase in STEPS:
+        phases[phase] = summarise(timings[phase])
+        if memory_cycles > 0:
+            phases[phase]["alloc_net_bytes"] = int(np.mean([x[0] for x in memory[phase]]))
+            phases[phase]["alloc_peak_bytes"] = int(max(x[1] for x in memory[phase]))
+    # the engine on its own is a rerun of update_counts' work, so it stays out of the cycle
+    cycle_seconds = np.sum([timings[phase] for phase in PHASES], axis=0)
+
+    return {
+        "config": {
+            "markets": markets,
+            "users": users,
+            "aggs": aggs,
+            "rate": rate,
+            "cycles": cycles,
+            "memory_cycles": memory_cycles,
+            "interval": interval,
+        },
+        "counters": len(watcher.counter),
+        "trades": trades,
+        "hits": hits,
+        "notifications": sum(sent),
+        "crash_reports": len(watcher.dispatcher.messages),
+        "startup_ms": startup * 1000,
+        "cycle": summarise(cycle_seconds),
+        "trades_per_sec": trades / cycle_seconds.sum(),
+        "trickle": phases.pop("trickle"),
+        "phases": phases,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmarks the cusum watcher offline")
+    parser.add_argument("--markets", type=int, default=20)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--aggs", type=int, default=4, help="aggregations per user")
+    parser.add_argument("--rate", type=float, default=5.0, help="trades per second per market")
+    parser.add_argument("--cycles", type=int, default=30)
+    parser.add_argument("--memory-cycles", type=int, default=5, help="cycles under tracemalloc")
+    parser.add_argument("--interval", type=int, default=10)
+    parser.add_argument("--label", help="a name for this run (e.g. the engine under test)")
+    parser.add_argument("--out", help="file to write the json to (default stdout)")
+    args = parser.parse_args()
+    out = os.path.abspath(args.out) if args.out else None
+
+    # the watcher writes its hit log and outbox to the working directory, so keep those out of the
+    # tree
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            result = bench(
+                markets=args.markets,
+                users=args.users,
+                aggs=args.aggs,
+                rate=args.rate,
+                cycles=args.cycles,
+                memory_cycles=args.memory_cycles,
+                interval=args.interval,
+            )
+        finally:
+            os.chdir(cwd)
+    result["label"] = args.label
+
+    output = json.dumps(result, indent=2)
+    if out:
+        with open(out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 """ a set of functions to relay debug messages to a specific person through telegram """
 
+import functools
 import os
 
 import requests
@@ -13,9 +14,19 @@ endpoint = "https://api.telegram.org/bot{BOT_TOKEN}/{METHOD_NAME}"
 postmsg_str = endpoint.format(BOT_TOKEN=BOT_TOKEN, METHOD_NAME="sendMessage")
 
 
-def send_notif(registry):
+def send_notif(registry, dispatcher=None, on_done=None):
+    """
+    sends each chat its message - queued on the dispatcher if given, otherwise one at a time
+    on_done(chat_id, delivered) is called as each one goes out
+    """
     for i in [x for x in list(registry.keys()) if x != -1]:
-        resp = requests.post(postmsg_str, data={"chat_id": i, "text": registry[i]}).json()
+        done = None if on_done is None else functools.partial(on_done, i)
+        if dispatcher is not None:
+            dispatcher.submit(i, registry[i], done)
+        else:
+            resp = requests.post(postmsg_str, data={"chat_id": i, "text": registry[i]})
+            if done is not None:
+                done(resp.ok)
 
 
 def send_crash_report(e):
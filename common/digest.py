@@ -0,0 +1,95 @@
+"""
+Coalescing notifications into digests.
+
+When the market moves hard, the same chat can have dozens of hits a cycle, cycle after cycle. One
+message each would spam the user and eat into telegram's rate limits, so hits are held per chat and
+sent together. A chat's first hit goes out straight away, and after that it gets at most one digest
+per window. Only the newest hit for each watch is kept, so a digest stays about as long as the
+chat's watchlist however often the watches fire.
+
+A digest over telegram's 4096 characters is split at the boundaries between hits, in a fixed order,
+so the same hits always make the same messages.
+
+"""
+
+import time
+
+LIMIT = 4096
+
+
+def split(items, limit=LIMIT):
+    """
+    packs (keys, text) items into (keys, text) messages of at most limit characters, in order.
+    When it takes more than one, each is numbered
+    """
+    parts = _pack(items, limit)
+    if len(parts) > 1:
+        parts = _pack(items, limit - 16)
+        parts = [
+            (keys, "({}/{})\n".format(i + 1, len(parts)) + text)
+            for i, (keys, text) in enumerate(parts)
+        ]
+    return parts
+
+
+def _pack(items, limit):
+    parts = []
+    keys, text = [], ""
+    for item_keys, item_text in items:
+        # a single hit that's too long on its own is cut up, its keys going with the last piece
+        pieces = [item_text[i : i + limit] for i in range(0, max(len(item_text), 1), limit)]
+        for i, piece in enumerate(pieces):
+            if len(text) > 0 and len(text) + 2 + len(piece) > limit:
+                parts.append((keys, text))
+                keys, text = [], ""
+            text = piece if len(text) == 0 else text + "\n\n" + piece
+            if i == len(pieces) - 1:
+                keys = keys + item_keys
+    if len(text) > 0:
+        parts.append((keys, text))
+    return parts
+
+
+class Digest:
+    def __init__(self, window=30, limit=LIMIT):
+        """
+        window - the least seconds between messages to a chat (0 sends everything straight away)
+        limit - the most characters in a message
+        """
+        self.window = window
+        self.limit = limit
+        self.held = {}  # chat id -> {watch: (keys, text)}
+        self.last = {}  # chat id -> when it was last sent to
+
+    def __len__(self):
+        return sum(len(held) for held in self.held.values())
+
+    def add(self, entries, watches={}):
+        """
+        holds (key, chat id, text) entries. watches maps a key to the watch it's a hit of - a newer
+        hit replaces the text of an older one for the same watch, and both keys go with the message.
+        Keys without a watch are kept as they are
+        """
+        for key, chat_id, text in entries:
+            watch = watches.get(key, key)
+            held = self.held.setdefault(chat_id, {})
+            keys = held[watch][0] if watch in held else []
+            held[watch] = (keys + [key], text)
+
+    def ready(self, now=None, flush=False):
+        """
+        the (keys, chat id, text) messages that can go out now - for every chat whose window has
+        passed (or every chat, with flush)
+        """
+        now = time.monotonic() if now is None else now
+        messages = []
+        for chat_id in sorted(self.held, key=str):
+            if not flush and now - self.last.get(chat_id, -self.window) < self.window:
+                continue
+            held = self.held.pop(chat_id)
+            self.last[chat_id] = now
+            for keys, text in split([held[watch] for watch in sorted(held)], self.limit):
+                messages.append((keys, chat_id, text))
+        # forget chats that have been quiet for a whole window
+        self.last = {chat_id: at for chat_id, at in self.last.items() if now - at < self.window}
+        return messages
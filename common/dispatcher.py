@@ -0,0 +1,148 @@
+"""
+A background dispatcher for telegram messages.
+
+Messages are queued per chat and sent by a small pool of worker threads over one keep-alive
+session, so whoever submits them never waits on http. Sends are paced by a global token bucket
+and one per chat (telegram allows about 30 messages a second overall and 1 a second to a chat).
+A 429 holds everything off for the retry_after telegram asks for. Each chat's messages go out one
+at a time and in order.
+
+The api url can be pointed at a local stand-in for testing.
+
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .ratelimit import TokenBucket
+
+TELEGRAM_API = "https://api.telegram.org"
+
+
+class Dispatcher:
+    def __init__(
+        self,
+        token,
+        api=TELEGRAM_API,
+        workers=8,
+        global_rate=30,
+        chat_rate=1,
+        timeout=10,
+        retries=5,
+    ):
+        """
+        token - the bot token
+        api - base url of the bot api
+        workers - how many messages can be in flight at once
+        global_rate, chat_rate - messages per second overall and to any one chat
+        timeout - seconds to wait on a request
+        retries - how many failed attempts (network errors and 5xx) before a message is dropped
+        """
+        self.url = "{}/bot{}/sendMessage".format(api, token)
+        self.timeout = timeout
+        self.retries = retries
+        self.chat_rate = chat_rate
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.bucket = TokenBucket(global_rate, burst=global_rate)
+        self.buckets = {}
+        self.chats = {}  # chat id -> deque of (text, on_done), for chats queued or in flight
+        self.ready = queue.Queue()
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, chat_id, text, on_done=None):
+        """
+        queues a message and returns straight away
+        on_done(delivered) is called from a worker once the message is sent or given up on
+        """
+        with self.lock:
+            if chat_id not in self.chats:
+                self.chats[chat_id] = deque()
+                self.buckets.setdefault(chat_id, TokenBucket(self.chat_rate, burst=1))
+                self.ready.put(chat_id)
+            self.chats[chat_id].append((text, on_done))
+            self.pending += 1
+
+    def flush(self, timeout=None):
+        """waits until everything queued has been sent (or given up on). False if it timed out"""
+        with self.idle:
+            return self.idle.wait_for(lambda: self.pending == 0, timeout)
+
+    def close(self, timeout=None):
+        """sends what's queued (waiting up to timeout) and stops the workers"""
+        self.flush(timeout)
+        for _ in self.workers:
+            self.ready.put(None)
+
+    def _work(self):
+        while True:
+            chat_id = self.ready.get()
+            if chat_id is None:
+                return
+            with self.lock:
+                text, on_done = self.chats[chat_id][0]
+                bucket = self.buckets[chat_id]
+            delivered = self._send(chat_id, text, bucket)
+            if on_done is not None:
+                try:
+                    on_done(delivered)
+                except Exception as e:
+                    print("dispatcher callback failed: {}".format(e))
+            with self.lock:
+                self.chats[chat_id].popleft()
+                if delivered:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                # back of the line, so one busy chat doesn't hold up the rest
+                if len(self.chats[chat_id]) > 0:
+                    self.ready.put(chat_id)
+                else:
+                    del self.chats[chat_id]
+                self.pending -= 1
+                if self.pending == 0:
+                    self.idle.notify_all()
+
+    def _send(self, chat_id, text, bucket):
+        """posts one message, waiting out rate limits and retrying failures. True if delivered"""
+        attempts = 0
+        while attempts < self.retries:
+            # the chat's own bucket last, so a wait on the global one can't bunch up its messages
+            self.bucket.acquire()
+            bucket.acquire()
+            try:
+                resp = self.session.post(
+                    self.url, data={"chat_id": chat_id, "text": text}, timeout=self.timeout
+                )
+            except requests.RequestException:
+                resp = None
+
+            if resp is not None and resp.status_code == 429:
+                # flood limits apply to the whole bot, so everything waits
+                try:
+                    retry_after = resp.json()["parameters"]["retry_after"]
+                except (ValueError, KeyError, TypeError):
+                    retry_after = 1
+                self.bucket.pause(retry_after)
+                continue
+            if resp is not None and resp.status_code < 500:
+                # anything else in the 4xx (blocked the bot, chat gone...) won't get better
+                return resp.ok
+
+            attempts += 1
+            time.sleep(min(2**attempts, 30))
+        return False
@@ -0,0 +1,167 @@
+"""
+A durable outbox for notifications.
+
+Every notification is appended to a local json lines file (and fsynced) before it is handed over
+for delivery, and acked once it's delivered. Anything still unacked after a crash or restart is
+sent again, so an alert goes out at least once. Each one has a dedup key: putting a key that is
+already pending, or was delivered recently, does nothing. That covers a restart re-counting trades
+the last run already alerted on.
+
+The file only ever grows by appending. Once enough entries have been acked it is rewritten with
+just the pending ones (and the recently delivered keys, for dedup), and swapped in atomically.
+
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class Outbox:
+    def __init__(self, path="outbox.jsonl", compact_every=1000, max_attempts=5, remember=10000):
+        """
+        path - the outbox file
+        compact_every - how many acks between rewrites of the file
+        max_attempts - how many failed deliveries before an entry is given up on
+        remember - how many delivered keys are kept for dedup
+        """
+        self.path = path
+        self.compact_every = compact_every
+        self.max_attempts = max_attempts
+        self.remember = remember
+        self.entries = OrderedDict()  # key -> entry, for everything not yet delivered
+        self.done = OrderedDict()  # recently delivered (or given up) keys
+        self.retry = []  # keys that failed and are due another go
+        self.acked = 0
+        self.lock = threading.Lock()
+        self._load()
+        self._compact()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, entries):
+        """
+        writes a batch of (key, chat id, text) to disk before delivery
+        returns the ones that were new (the rest were duplicates)
+        """
+        with self.lock:
+            new = []
+            for key, chat_id, text in entries:
+                if key in self.entries or key in self.done:
+                    continue
+                entry = {"key": key, "chat_id": chat_id, "text": text, "time": time.time_ns()}
+                self.entries[key] = dict(entry, attempts=0)
+                self._write(dict(entry, op="put"))
+                new.append((key, chat_id, text))
+            if len(new) > 0:
+                self._sync()
+            return new
+
+    def ack(self, keys):
+        """marks entries as delivered"""
+        with self.lock:
+            for key in keys:
+                if self.entries.pop(key, None) is not None:
+                    self._forget(key)
+                    self._write({"op": "ack", "key": key})
+            self.file.flush()
+            if self.acked >= self.compact_every:
+                self._compact()
+
+    def fail(self, keys):
+        """
+        records a failed delivery. The entries are retried (see due) until they run out of
+        attempts, then dropped
+        """
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                entry["attempts"] += 1
+                if entry["attempts"] >= self.max_attempts:
+                    del self.entries[key]
+                    self._forget(key)
+                    self._write({"op": "ack", "key": key, "failed": True})
+                else:
+                    self.retry.append(key)
+                    self._write({"op": "fail", "key": key})
+            self.file.flush()
+
+    def pending(self):
+        """every undelivered entry, oldest first - what a restart has to send"""
+        with self.lock:
+            self.retry = []
+            return [(e["key"], e["chat_id"], e["text"]) for e in self.entries.values()]
+
+    def due(self):
+        """the entries that failed since the last call and should be sent again"""
+        with self.lock:
+            keys, self.retry = self.retry, []
+            return [
+                (key, self.entries[key]["chat_id"], self.entries[key]["text"])
+                for key in keys
+                if key in self.entries
+            ]
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    def _forget(self, key):
+        self.done[key] = None
+        if len(self.done) > self.remember:
+            self.done.popitem(last=False)
+        self.acked += 1
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _load(self):
+        """replays the file. A torn last line (a crash mid-write) is skipped"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                key = record["key"]
+                if record["op"] == "put":
+                    if key not in self.done:
+                        self.entries[key] = {
+                            "key": key,
+                            "chat_id": record["chat_id"],
+                            "text": record["text"],
+                            "time": record["time"],
+                            "attempts": record.get("attempts", 0),
+                        }
+                elif record["op"] == "fail" and key in self.entries:
+                    self.entries[key]["attempts"] += 1
+                elif record["op"] == "ack":
+                    self.entries.pop(key, None)
+                    self._forget(key)
+
+    def _compact(self):
+        """rewrites the file with only the pending entries and the remembered keys"""
+        if hasattr(self, "file"):
+            self.file.close()
+        temp = self.path + ".tmp"
+        with open(temp, "w") as f:
+            for key in self.done:
+                f.write(json.dumps({"op": "ack", "key": key}) + "\n")
+            for entry in self.entries.values():
+                f.write(json.dumps(dict(entry, op="put")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)
+        self.file = open(self.path, "a")
+        self.acked = 0
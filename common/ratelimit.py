@@ -0,0 +1,37 @@
+"""a thread-safe token bucket, shared by the exchange fetches and the telegram dispatcher"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=10):
+        """
+        A thread-safe token bucket
+        rate - tokens added per second
+        burst - the most tokens that can be saved up
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, cost=1):
+        """blocks until cost tokens are available and takes them"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + max(now - self.stamp, 0) * self.rate)
+                self.stamp = max(now, self.stamp)
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+                wait = (cost - self.tokens) / self.rate + max(self.stamp - now, 0)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """empties the bucket and holds off refilling it for a while (e.g. when told to back off)"""
+        with self.lock:
+            self.tokens = 0
+            self.stamp = max(self.stamp, time.monotonic() + seconds)
@@ -0,0 +1,76 @@
+"""
+A rate-limited crash reporter.
+
+During an exchange outage the same error comes up for every market every cycle. Rather than
+posting each one to the admin, the first of each distinct error in a window is reported straight
+away (up to a limit) and the repeats are only counted. When the window is up, one summary lists
+how many times each error came up since and where.
+
+"""
+
+import threading
+import time
+
+from .bot_debug import send_crash_report
+
+
+def _where(where, most=10):
+    """the places an error came up, as " (a, b, c +2 more)" - empty if none were given"""
+    if len(where) == 0:
+        return ""
+    where = sorted(map(str, where))
+    more = "" if len(where) <= most else " +{} more".format(len(where) - most)
+    return " ({}{})".format(", ".join(where[:most]), more)
+
+
+class CrashReporter:
+    def __init__(self, send=send_crash_report, window=300, limit=5):
+        """
+        send - posts a report's text to the admin
+        window - seconds over which repeats of an error are rolled up into one summary
+        limit - the most errors reported straight away in a window
+        """
+        self.send = send
+        self.window = window
+        self.limit = limit
+        self.lock = threading.Lock()
+        self._reset(time.monotonic())
+
+    def report(self, e, where=None):
+        """notes an exception (and where it happened, e.g. the market). Safe from any thread"""
+        key = "{}: {}".format(type(e).__name__, str(e)[:200])
+        with self.lock:
+            seen = self.errors.setdefault(key, {"count": 0, "reported": 0, "where": set()})
+            seen["count"] += 1
+            if where is not None:
+                seen["where"].add(where)
+            send = seen["count"] == 1 and self.reported < self.limit
+            if send:
+                seen["reported"] = 1
+                self.reported += 1
+        if send:
+            self.send(key if where is None else "{} ({})".format(key, where))
+
+    def flush(self):
+        """sends the summary of the repeats once the window is up"""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.began < self.window:
+                return
+            unreported = {
+                key: seen for key, seen in self.errors.items() if seen["count"] > seen["reported"]
+            }
+            self._reset(now)
+        if len(unreported) > 0:
+            self.send(
+                "in the last {}s:\n".format(self.window)
+                + "\n".join(
+                    "{}x {}{}".format(seen["count"] - seen["reported"], key, _where(seen["where"]))
+                    for key, seen in unreported.items()
+                )
+            )
+
+    def _reset(self, now):
+        self.began = now
+        self.errors = {}
+        self.reported = 0
@@ -12,7 +12,9 @@ try:
 except NameError:
     basestring = str  # Python 2
 import hashlib
+from operator import itemgetter
 
+import numpy as np
 from ccxt.base.decimal_to_precision import TICK_SIZE
 from ccxt.base.errors import (
     ArgumentsRequired,
@@ -868,7 +870,11 @@ class ftx(Exchange):
             "fee": fee,
         }
 
-    def fetch_trades(self, symbol, since=None, until=None, limit=None, params={}):
+    def fetch_trades(self, symbol, since=None, until=None, limit=None, params={}, raw=False):
+        #
+        # raw skips parse_trade and returns the rows exactly as ftx sends them (newest first);
+        # use parse_trade_columns (or fetch_trades_raw) to turn them into arrays in one go
+        #
         self.load_markets()
         market, marketId = self.get_market_params(symbol, "market_name", params)
         request = {
@@ -906,8 +912,126 @@ class ftx(Exchange):
         #     }
         #
         result = self.safe_value(response, "result", [])
+        if raw:
+            return result
         return self.parse_trades(result, market, since, limit)
 
+    def parse_trade_times(self, times):
+        #
+        # bulk ISO-8601 -> int64 epoch ns, parsed vectorised rather than parse8601 row by row
+        #
+        # ftx stamps every trade in utc (+00:00) and drops the fraction when it is zero. numpy
+        # parses naive ISO strings with or without a fraction, on any pandas/numpy version
+        #
+        if len(times) == 0:
+            return np.zeros(0, dtype=np.int64)
+        naive = [t[:-6] if t.endswith("+00:00") else t.rstrip("Z") for t in times]
+        return np.array(naive, dtype="datetime64[ns]").astype(np.int64)
+
+    def parse_trade_columns(self, trades):
+        #
+        # ftx public trade rows -> columnar arrays, without building a unified trade per row
+        #
+        #     id int64, time int64 (epoch ns), price/size float64, side int8 (1 buy, -1 sell),
+        #     liquidation bool
+        #
+        if len(trades) == 0:
+            return {
+                "id": np.zeros(0, dtype=np.int64),
+                "time": np.zeros(0, dtype=np.int64),
+                "price": np.zeros(0, dtype=np.float64),
+                "size": np.zeros(0, dtype=np.float64),
+                "side": np.zeros(0, dtype=np.int8),
+                "liquidation": np.zeros(0, dtype=np.bool_),
+            }
+        ids, times, prices, sizes, sides, liquidations = zip(
+            *map(itemgetter("id", "time", "price", "size", "side", "liquidation"), trades)
+        )
+        return {
+            "id": np.array(ids, dtype=np.int64),
+            "time": self.parse_trade_times(times),
+            "price": np.array(prices, dtype=np.float64),
+            "size": np.array(sizes, dtype=np.float64),
+            "side": np.where(np.array(sides) == "buy", 1, -1).astype(np.int8),
+            "liquidation": np.array(liquidations, dtype=np.bool_),
+        }
+
+    def fetch_trades_raw(self, symbol, since=None, until=None, limit=None, params={}):
+        #
+        # the lean public trades call: the response goes straight into columnar arrays
+        # (see parse_trade_columns), in the order ftx sends them (newest first)
+        #
+        return self.parse_trade_columns(
+            self.fetch_trades(
+                symbol, since=since, until=until, limit=limit, params=params, raw=True
+            )
+        )
+
+    def fetch_trades_paginated(
+        self,
+        symbol,
+        since,
+        until,
+        last_id=None,
+        page_limit=5000,
+        max_pages=50,
+        params={},
+        raw=False,
+    ):
+        #
+        # ftx caps the rows returned per request and returns the newest first, so walk the
+        # window backwards by end_time until we reach since (a short page) or a trade we have
+        # already seen (last_id). If neither can be proven the result is flagged as a gap.
+        # With raw the pages come from fetch_trades_raw and the result is one set of columns
+        # (deduplicated and ordered by id) rather than a list of unified trades.
+        #
+        pages = []
+        rows = 0
+        gap = True
+        end = until
+        while len(pages) < max_pages:
+            if raw:
+                page = self.fetch_trades_raw(
+                    symbol, since=since, until=end, limit=page_limit, params=params
+                )
+                pageSize = len(page["id"])
+            else:
+                page = self.fetch_trades(
+                    symbol, since=since, until=end, limit=page_limit, params=params
+                )
+                pageSize = len(page)
+            pages.append(page)
+            rows += pageSize
+            if pageSize < page_limit:
+                gap = False
+                break
+            if raw:
+                oldest = int(np.argmin(page["time"]))
+                oldestId = page["id"][oldest]
+                oldestTimestamp = int(page["time"][oldest] // 1000000)
+            else:
+                oldestId = page[0]["id"]
+                oldestTimestamp = page[0]["timestamp"]
+            if last_id is not None and int(oldestId) <= int(last_id):
+                gap = False
+                break
+            # end_time has second resolution: if a whole page sits inside one second we can't
+            # step back any further
+            if int(oldestTimestamp / 1000) >= int(end / 1000):
+                break
+            end = oldestTimestamp
+        report = {"pages": len(pages), "rows": rows, "gap": gap}
+        if raw:
+            columns = {key: np.concatenate([page[key] for page in pages]) for key in pages[0]}
+            ids, keep = np.unique(columns["id"], return_index=True)
+            return {key: value[keep] for key, value in columns.items()}, report
+        trades = {}
+        for page in pages:
+            for trade in page:
+                trades[trade["id"]] = trade
+        result = sorted(trades.values(), key=lambda x: (x["timestamp"], int(x["id"])))
+        return result, report
+
     def fetch_trading_fees(self, params={}):
         self.load_markets()
         response = self.privateGetAccount(params)
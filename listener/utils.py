@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from common.msg_utils import validate_add_delete
 
 
@@ -50,6 +52,7 @@ def add_delete(action=None, mongo=None, usr_id=None, usr_name=None, in_msg=None,
                         "TGUsername": usr_name,
                         "TGChatID": usr_id,
                         "watchList": [{"market": ticker, "aggs": []}],
+                        "updatedAt": datetime.utcnow(),
                     }
                 )
                 return "You haven't got a watchlist yet. I've set one up and added {}".format(
@@ -60,6 +63,8 @@ def add_delete(action=None, mongo=None, usr_id=None, usr_name=None, in_msg=None,
                 return "You haven't got a watchlist yet. Set one up automatically by adding a watch via\n/new {ticker} {type}_{agg}_{filter_percentage}"
         else:
             entry = edit_watchlist(action, found_profile[0], ticker, agg)
+            # the watcher polls this stamp for changes when it can't use a change stream
+            entry["updatedAt"] = datetime.utcnow()
             mongo["cusum"].watchList.replace_one({"TGChatID": usr_id}, entry)
 
             if action == "add":
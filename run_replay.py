@@ -0,0 +1,39 @@
+"""replays a recorded trade tape through the cusum watcher"""
+
+import argparse
+import json
+import sys
+
+from loguru import logger
+
+from watcher.replay import Replay, load_tape, load_watchlist
+
+
+@logger.catch
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("tape", help=".csv or .jsonl of ftx trade rows with a market column")
+    parser.add_argument("watchlist", help="json list of watchList documents")
+    parser.add_argument("--interval", type=float, default=10, help="seconds per simulated cycle")
+    parser.add_argument("--out", help="where to write the hits as json lines (default stdout)")
+    args = parser.parse_args()
+
+    replay = Replay(load_tape(args.tape), load_watchlist(args.watchlist), interval=args.interval)
+    hits = replay.run()
+
+    out = open(args.out, "w") if args.out else sys.stdout
+    for hit in hits:
+        out.write(json.dumps(hit) + "\n")
+    if args.out:
+        out.close()
+
+    print(
+        "{trades} trades over {cycles} cycles, {hits} hits in {seconds:.3f}s "
+        "({trades_per_sec:,.0f} trades/s)".format(**replay.stats),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
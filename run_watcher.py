@@ -1,5 +1,7 @@
 """ kicks off the cusum watcher process """
 
+import signal
+import sys
 
 from loguru import logger
 
@@ -11,9 +13,17 @@ def main():
 
     watcher = CUSUM(
         interval=10,
+        metrics_port=9108,
     )
 
-    watcher.run()
+    # SIGTERM and ctrl-c let the current cycle finish, so the watcher checkpoints between cycles
+    signal.signal(signal.SIGTERM, lambda *args: watcher.stop())
+    signal.signal(signal.SIGINT, lambda *args: watcher.stop())
+
+    if "--stream" in sys.argv:
+        watcher.run_stream()
+    else:
+        watcher.run()
 
 
 if __name__ == "__main__":
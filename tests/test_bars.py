@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from watcher.bars import BarGenerator, cumulative
+from watcher.engine import trickle
+from watcher.trades import to_trades
+
+
+def make_trades(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return to_trades(
+        id=np.arange(n),
+        time=np.arange(n) * 1000,
+        price=100 + np.arange(n) + rng.normal(0, 0.1, n).round(2),
+        size=rng.exponential(1, n).round(4),
+        side=np.ones(n),
+        liquidation=np.zeros(n, dtype=bool),
+    )
+
+
+def test_tick_bars_close_every_agg_unit():
+    trades = make_trades(30)
+    closes = BarGenerator("tick", 7).update(trades)
+    assert len(closes) == 4
+    assert np.isin(closes["close"], trades["price"]).all()
+    assert (np.diff(closes["time"]) == 7000).all()
+
+
+@pytest.mark.parametrize(
+    "agg_type, agg_unit", [("tick", 7), ("tick", 3), ("volume", 1.7), ("dollar", 230.0)]
+)
+def test_bars_reproduce_the_live_engine(agg_type, agg_unit):
+    # a backtest fed the watcher's batches has to land on the same counter state as the engine
+    trades = make_trades(200, seed=1)
+    rng = np.random.default_rng(2)
+    splits = np.sort(rng.choice(199, 30, replace=False)) + 1
+
+    bars = BarGenerator(agg_type, agg_unit, last_close=float(trades["price"][0]))
+    count, cusum_count, last_agg_price = [0.0], [0.0], [float(trades["price"][0])]
+    last_price, moves = last_agg_price[0], 0.0
+    for batch in np.split(trades, splits):
+        moves += bars.update(batch)["move"].sum()
+        count, cusum_count, last_agg_price, _, _ = trickle(
+            cumulative(batch, agg_type),
+            batch["price"],
+            count,
+            cusum_count,
+            last_agg_price,
+            [agg_unit],
+            [np.inf],
+            last_price,
+        )
+        last_price = float(batch["price"][-1])
+        assert bars.count == count[0] and bars.last_close == last_agg_price[0]
+    assert moves == pytest.approx(cusum_count[0])
@@ -0,0 +1,74 @@
+from common.digest import Digest, split
+
+
+def test_first_hit_goes_out_at_once_then_one_digest_per_window():
+    digest = Digest(window=30)
+    digest.add([("a:1", 1, "first")], {"a:1": "a"})
+    assert digest.ready(now=100) == [(["a:1"], 1, "first")]
+
+    # held until the window has passed
+    digest.add([("a:2", 1, "second")], {"a:2": "a"})
+    digest.add([("b:1", 1, "other watch")], {"b:1": "b"})
+    assert digest.ready(now=110) == []
+    assert digest.ready(now=129.9) == []
+    assert digest.ready(now=130) == [(["a:2", "b:1"], 1, "second\n\nother watch")]
+
+    # another chat isn't held back by the first one's window
+    digest.add([("a:1", 2, "hello")], {"a:1": "a"})
+    assert digest.ready(now=131) == [(["a:1"], 2, "hello")]
+
+    # a chat quiet for a whole window is sent to straight away again
+    assert digest.ready(now=200) == []
+    digest.add([("a:3", 1, "later")], {"a:3": "a"})
+    assert digest.ready(now=200) == [(["a:3"], 1, "later")]
+
+
+def test_newest_text_per_watch_is_kept_with_every_key():
+    digest = Digest(window=30)
+    digest.add([("w:0", 1, "first")], {"w:0": "w"})
+    assert digest.ready(now=0) == [(["w:0"], 1, "first")]
+    digest.add([("w:1", 1, "old"), ("w:2", 1, "new")], {"w:1": "w", "w:2": "w"})
+    digest.add([("w:3", 1, "newest"), ("x", 1, "unwatched")], {"w:3": "w"})
+    assert len(digest) == 2
+    assert digest.ready(now=30) == [(["w:1", "w:2", "w:3", "x"], 1, "newest\n\nunwatched")]
+
+
+def test_flush_sends_everything_held():
+    digest = Digest(window=30)
+    digest.add([("a", 1, "one")])
+    digest.ready(now=0)
+    digest.add([("b", 1, "two"), ("c", 2, "three")])
+    assert digest.ready(now=1, flush=True) == [(["b"], 1, "two"), (["c"], 2, "three")]
+    assert len(digest) == 0
+
+
+def test_long_digests_split_under_the_limit_with_numbered_headers():
+    items = [(["k{}".format(i)], "hit {} ".format(i) + "x" * (i * 37 % 300)) for i in range(60)]
+    parts = split(items, limit=1000)
+    assert len(parts) > 1
+    assert all(len(text) <= 1000 for _, text in parts)
+    assert [text.split("\n", 1)[0] for _, text in parts] == [
+        "({}/{})".format(i + 1, len(parts)) for i in range(len(parts))
+    ]
+    # every hit is in exactly one part, in order, with its keys
+    assert [key for keys, _ in parts for key in keys] == ["k{}".format(i) for i in range(60)]
+    body = "\n\n".join(text.split("\n", 1)[1] for _, text in parts)
+    assert body == "\n\n".join(text for _, text in items)
+    # and the same hits always make the same messages
+    assert split(items, limit=1000) == parts
+
+
+def test_split_fits_the_header_into_a_nearly_full_message():
+    items = [(["a"], "a" * 600), (["b"], "b" * 398)]
+    # 600 + 2 + 398 fits exactly without headers
+    assert split(items, limit=1000) == [(["a", "b"], "a" * 600 + "\n\n" + "b" * 398)]
+    parts = split(items + [(["c"], "c")], limit=1000)
+    assert all(len(text) <= 1000 for _, text in parts)
+    assert parts[0][1].startswith("(1/2)\n")
+
+
+def test_a_hit_longer_than_the_limit_is_cut_up():
+    parts = split([(["a"], "a" * 2500)], limit=1000)
+    assert all(len(text) <= 1000 for _, text in parts)
+    assert [keys for keys, _ in parts] == [[], [], ["a"]]
+    assert "".join(text.split("\n", 1)[1] for _, text in parts) == "a" * 2500
@@ -0,0 +1,74 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import pytest
+
+from common.dispatcher import Dispatcher
+
+
+class FakeTelegram:
+    """a local sendMessage that answers with the queued responses first, then 200s"""
+
+    def __init__(self):
+        self.responses = []
+        self.received = []  # (time, chat id, text) of every request
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+                fake.received.append((time.monotonic(), body["chat_id"][0], body["text"][0]))
+                status, reply = fake.responses.pop(0) if fake.responses else (200, {"ok": True})
+                data = json.dumps(reply).encode()
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def telegram():
+    fake = FakeTelegram()
+    yield fake
+    fake.server.shutdown()
+
+
+def test_waits_out_retry_after_then_delivers_in_order(telegram):
+    telegram.responses.append((429, {"ok": False, "parameters": {"retry_after": 1}}))
+    dispatcher = Dispatcher("token", api=telegram.url, workers=2, chat_rate=100)
+    done = []
+    for text in ["a", "b", "c"]:
+        dispatcher.submit(1, text, lambda delivered, text=text: done.append((text, delivered)))
+
+    assert dispatcher.flush(timeout=10)
+    dispatcher.close()
+
+    # the 429'd message was sent again, no sooner than telegram asked
+    times = [at for at, _, _ in telegram.received]
+    assert [text for _, _, text in telegram.received] == ["a", "a", "b", "c"]
+    assert times[1] - times[0] >= 0.95
+    assert done == [("a", True), ("b", True), ("c", True)]
+    assert (dispatcher.sent, dispatcher.failed) == (3, 0)
+
+
+def test_drops_messages_telegram_rejects(telegram):
+    telegram.responses.append((403, {"ok": False}))
+    dispatcher = Dispatcher("token", api=telegram.url, workers=1, chat_rate=100)
+    done = []
+    dispatcher.submit(1, "blocked", done.append)
+    dispatcher.submit(1, "next", done.append)
+
+    assert dispatcher.flush(timeout=10)
+    dispatcher.close()
+    assert done == [False, True]
+    assert len(telegram.received) == 2
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from watcher.engine import trickle
+
+
+def reference_trickle(record, recent_index, last_price):
+    """the original per-record CUSUM._trickle, which the engine has to match exactly"""
+    record["hit"] = False
+    if len(recent_index) > 0:
+        multiples = int(round(record["count"] // 1))
+        if multiples > 0:
+            rem = round(record["count"] - multiples, 7)
+            pos = [
+                max(recent_index.keys()) - (rem + x) * record["agg_unit"] for x in range(multiples)
+            ]
+            idxs = []
+            for idx in pos:
+                try:
+                    idxs.append(max([x for x in list(recent_index.keys()) if x <= idx]))
+                except ValueError:
+                    idxs.append(False)
+
+            for idx in sorted(idxs):
+                if idx:
+                    record["cusum_count"] += (
+                        abs(recent_index[idx] / record["last_agg_price"] - 1) * 100
+                    )
+                    record["last_agg_price"] = recent_index[idx]
+                else:
+                    record["cusum_count"] += abs(last_price / record["last_agg_price"] - 1) * 100
+                    record["last_agg_price"] = last_price
+
+            record["count"] = rem
+
+        if record["cusum_count"] > record["agg_perc"]:
+            record["hit"] = True
+            record["cusum_count"] = record["cusum_count"] - record["agg_perc"] * (
+                record["cusum_count"] // record["agg_perc"]
+            )
+    return record
+
+
+UNITS = {"tick": [1, 3, 10, 50], "volume": [0.5, 5, 20], "dollar": [30, 500, 3000]}
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("agg_type", ["tick", "volume", "dollar"])
+def test_trickle_matches_reference(agg_type, seed):
+    rng = np.random.default_rng(seed)
+    n = 40
+    unit = rng.choice(UNITS[agg_type], n).astype(float)
+    perc = rng.choice([0.1, 0.5, 2.0], n)
+    count = np.where(rng.random(n) < 0.5, 0.0, rng.random(n).round(3))
+    cusum_count = np.zeros(n)
+    last_agg_price = np.full(n, 100.0)
+
+    for cycle in range(25):
+        k = int(rng.integers(0, 150))
+        price = 100 * np.exp(np.cumsum(rng.normal(0, 0.003, k)))
+        size = rng.exponential(1, k).round(4)
+        if k > 0 and rng.random() < 0.1:
+            size[0] = 0.0
+        if agg_type == "tick":
+            cum = np.arange(1, k + 1)
+        elif agg_type == "volume":
+            cum = np.cumsum(size)
+        else:
+            cum = np.cumsum(size * price)
+        last_price = 100 + rng.normal()
+
+        recent_index = {x: p for x, p in zip(cum.tolist(), price.tolist())}
+        expected = []
+        for i in range(n):
+            record = {
+                "agg_unit": unit[i],
+                "agg_perc": perc[i],
+                "count": count[i] + (cum[-1] / unit[i] if k > 0 else 0.0),
+                "cusum_count": cusum_count[i],
+                "last_agg_price": last_agg_price[i],
+            }
+            expected.append(reference_trickle(record, recent_index, last_price))
+
+        count, cusum_count, last_agg_price, hit, trigger = trickle(
+            cum, price, count, cusum_count, last_agg_price, unit, perc, last_price
+        )
+        assert count.tolist() == [r["count"] for r in expected]
+        assert cusum_count.tolist() == [r["cusum_count"] for r in expected]
+        assert last_agg_price.tolist() == [r["last_agg_price"] for r in expected]
+        assert hit.tolist() == [r["hit"] for r in expected]
+        assert ((trigger >= 0) <= hit).all() and (trigger < max(k, 1)).all()
+
+
+def test_trickle_needs_a_last_price():
+    with pytest.raises(ValueError):
+        trickle(np.arange(1, 4), [100.0, 101.0, 102.0], [0.0], [0.0], [100.0], [1.0], [1.0], None)
@@ -0,0 +1,88 @@
+import pytest
+
+from exchanges.ftx_rest import ftx
+
+START = 1646136000000  # epoch ms
+
+
+class FakeFtx(ftx):
+    """serves a tape from a capped, newest-first trades endpoint with second-resolution bounds"""
+
+    def __init__(self, times):
+        super().__init__()
+        self.rows = [
+            {
+                "id": i + 1,
+                "time": self.iso8601(t),
+                "timestamp": t,
+                "price": 100.0 + i,
+                "size": 1.0,
+                "side": "buy",
+                "liquidation": False,
+            }
+            for i, t in enumerate(times)
+        ]
+        self.requests = []
+
+    def fetch_trades(self, symbol, since=None, until=None, limit=None, params={}, raw=False):
+        self.requests.append((since, until))
+        rows = [
+            row
+            for row in self.rows
+            if since // 1000 <= row["timestamp"] // 1000 <= until // 1000
+        ]
+        rows = rows[::-1][:limit]
+        if raw:
+            return rows
+        # unified trades come back oldest first, with string ids
+        return [
+            {"id": str(row["id"]), "timestamp": row["timestamp"], "price": row["price"]}
+            for row in rows[::-1]
+        ]
+
+
+def fetch(exchange, raw, **kwargs):
+    until = exchange.rows[-1]["timestamp"]
+    trades, report = exchange.fetch_trades_paginated(
+        "BTC-PERP", START, until, page_limit=10, raw=raw, **kwargs
+    )
+    ids = trades["id"].tolist() if raw else [int(trade["id"]) for trade in trades]
+    return ids, report
+
+
+def every_second(n):
+    return [START + 500 + 1000 * i for i in range(n)]
+
+
+@pytest.mark.parametrize("raw", [True, False])
+def test_pages_back_to_since_and_drops_the_overlap(raw):
+    exchange = FakeFtx(every_second(30))
+    ids, report = fetch(exchange, raw)
+    # each page's end_time is its oldest trade's second, so that trade comes back again
+    assert ids == list(range(1, 31))
+    assert report == {"pages": 4, "rows": 33, "gap": False}
+    assert [until // 1000 for _, until in exchange.requests[1:]] == [
+        exchange.rows[i]["timestamp"] // 1000 for i in [20, 11, 2]
+    ]
+
+
+@pytest.mark.parametrize("raw", [True, False])
+def test_stops_at_a_trade_already_seen(raw):
+    ids, report = fetch(FakeFtx(every_second(30)), raw, last_id=15)
+    assert ids == list(range(12, 31))
+    assert report == {"pages": 2, "rows": 20, "gap": False}
+
+
+@pytest.mark.parametrize("raw", [True, False])
+def test_a_full_page_inside_one_second_is_a_gap(raw):
+    exchange = FakeFtx(every_second(5) + [START + 6000 + i for i in range(20)])
+    ids, report = fetch(exchange, raw)
+    assert ids == list(range(16, 26))
+    assert report == {"pages": 1, "rows": 10, "gap": True}
+
+
+@pytest.mark.parametrize("raw", [True, False])
+def test_stops_at_max_pages_and_flags_a_gap(raw):
+    ids, report = fetch(FakeFtx(every_second(100)), raw, max_pages=3)
+    assert ids == list(range(73, 101))
+    assert report == {"pages": 3, "rows": 30, "gap": True}
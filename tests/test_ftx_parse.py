@@ -0,0 +1,7 @@
+from exchanges.ftx_rest import ftx
+
+
+def test_trade_times_with_and_without_fractional_seconds():
+    # ftx drops the fraction when the microseconds are zero
+    times = ["2022-03-01T12:58:38.123456+00:00", "2022-03-01T12:58:38+00:00"]
+    assert ftx().parse_trade_times(times).tolist() == [1646139518123456000, 1646139518000000000]
@@ -0,0 +1,40 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from watcher.ingest import fetch_all
+
+
+def test_a_hung_market_sits_the_cycle_out():
+    release = threading.Event()
+    calls = []
+
+    def fetch(market):
+        calls.append(market)
+        if market == "HUNG":
+            release.wait()
+        return market.lower()
+
+    pool = ThreadPoolExecutor(max_workers=4)
+    pending = {}
+    began = time.monotonic()
+    assert fetch_all(pool, fetch, ["A", "HUNG", "B"], timeout=0.2, pending=pending) == {
+        "A": "a",
+        "B": "b",
+    }
+    assert time.monotonic() - began < 1
+    assert list(pending) == ["HUNG"]
+
+    # still hung - it isn't fetched a second time
+    assert fetch_all(pool, fetch, ["A", "HUNG"], timeout=0.2, pending=pending) == {"A": "a"}
+    assert calls.count("HUNG") == 1
+
+    # once it answers, its result is handed over on the next call
+    release.set()
+    pending["HUNG"].result(timeout=1)
+    assert fetch_all(pool, fetch, ["A", "HUNG"], timeout=0.2, pending=pending) == {
+        "A": "a",
+        "HUNG": "hung",
+    }
+    assert calls.count("HUNG") == 1 and pending == {}
+    pool.shutdown()
@@ -0,0 +1,34 @@
+from watcher import levels
+from watcher.levels import LevelIndex
+
+
+class Collection:
+    """a keyPriceLevels stand-in without a change stream (the levels carry no updatedAt)"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query={}):
+        return [dict(doc) for doc in self.docs if all(key in doc for key in query)]
+
+
+def test_edited_levels_are_picked_up_without_hits(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(levels.time, "monotonic", lambda: clock[0])
+    collection = Collection([{"_id": 1, "name": "BTC", "levels": ["100", "200", "300"]}])
+    index = LevelIndex(collection, every=60, resync_every=2)
+    index.refresh()
+    assert index.active_range("BTC/USD", 150) == (100.0, 200.0)
+    assert index.active_range("BTC/USD", 350) == (300.0, None)
+    assert index.active_range("ETH/USD", 150) == (None, None)
+
+    collection.docs[0]["levels"] = ["100", "160", "200"]
+    collection.docs.append({"_id": 2, "name": "ETH", "levels": ["10"]})
+    index.refresh()  # too soon to poll
+    clock[0] += 60
+    index.refresh()  # polled, but only a full read sees an edit without a stamp
+    assert index.active_range("BTC/USD", 150) == (100.0, 200.0)
+    clock[0] += 60
+    index.refresh()
+    assert index.active_range("BTC/USD", 150) == (100.0, 160.0)
+    assert index.active_range("ETH/USD", 150) == (10.0, None)
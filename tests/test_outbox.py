@@ -0,0 +1,31 @@
+from common.outbox import Outbox
+
+
+def test_unsent_entries_survive_a_torn_write(tmp_path):
+    path = str(tmp_path / "outbox.jsonl")
+    outbox = Outbox(path)
+    outbox.put([("a", 1, "first"), ("b", 2, "second"), ("c", 1, "third")])
+    outbox.ack(["a"])
+    outbox.close()
+    # the process died halfway through writing the next entry
+    with open(path, "a") as f:
+        f.write('{"op": "put", "key": "d", "chat_id": 1, "te')
+
+    outbox = Outbox(path)
+    assert outbox.pending() == [("b", 2, "second"), ("c", 1, "third")]
+    # delivered and pending keys are both still deduplicated after the restart
+    assert outbox.put([("a", 1, "first"), ("b", 2, "second")]) == []
+    assert outbox.put([("d", 1, "fourth")]) == [("d", 1, "fourth")]
+
+    outbox.ack(["b", "c", "d"])
+    outbox.close()
+    assert Outbox(path).pending() == []
+
+
+def test_failed_entries_are_retried_then_given_up(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.jsonl"), max_attempts=2)
+    outbox.put([("a", 1, "text")])
+    outbox.fail(["a"])
+    assert outbox.due() == [("a", 1, "text")]
+    outbox.fail(["a"])
+    assert outbox.due() == [] and len(outbox) == 0
@@ -0,0 +1,130 @@
+import numpy as np
+
+from watcher.store import CounterStore
+
+
+def sub(market, agg, user="u1", chat=1):
+    agg_type, agg_unit, agg_perc = agg.split("_")
+    return ((market, agg_type, float(agg_unit), float(agg_perc)), user, chat)
+
+
+def check(store):
+    """the side indexes and market codes agree with the rows"""
+    keys = [store.key(row) for row in range(len(store))]
+    assert store._index == {key: row for row, key in enumerate(keys)}
+    series = {}
+    for key in keys:
+        series.setdefault(key[:3], set()).add(key)
+    assert store._series == series
+    assert sorted(set(store.market.tolist())) == list(range(len(store.markets)))
+    for (market, agg_type), rows in store.groups().items():
+        assert {store.key(row)[:2] for row in rows.tolist()} == {(market, agg_type)}
+    assert sum(len(rows) for rows in store.groups().values()) == len(store)
+    for name in ["agg_type", "agg_unit", "count", "cusum_count", "last_agg_price", "hit"]:
+        assert len(getattr(store, name)) == len(store)
+    assert len(store.users) == len(store.ids) == len(store)
+
+
+def state(store):
+    """{key: (count, cusum_count, last_agg_price, ids)} for every counter"""
+    return {
+        store.key(row): (
+            store.count[row],
+            store.cusum_count[row],
+            store.last_agg_price[row],
+            list(store.ids[row]),
+        )
+        for row in range(len(store))
+    }
+
+
+def make_store():
+    store = CounterStore()
+    store.reconcile(
+        [
+            sub("BTC-PERP", "tick_5_1"),
+            sub("BTC-PERP", "volume_2_1"),
+            sub("ETH-PERP", "tick_5_1"),
+            sub("ETH-PERP", "dollar_100_2", chat=2),
+            sub("SOL-PERP", "tick_1_1"),
+        ],
+        prices={"BTC-PERP": 100.0, "ETH-PERP": 10.0, "SOL-PERP": 1.0},
+    )
+    # give every counter some state of its own
+    store.count[:] = np.arange(len(store)) / 10
+    store.cusum_count[:] = np.arange(len(store)) / 100
+    store.last_agg_price[:] += np.arange(len(store))
+    check(store)
+    return store
+
+
+def test_emptying_a_middle_row_keeps_the_indexes_pointing_at_the_right_rows():
+    store = make_store()
+    before = state(store)
+    middle = sub("ETH-PERP", "tick_5_1")
+    assert 0 < store._index[middle[0]] < len(store) - 1
+
+    assert store.reconcile(unsubscribe=[middle]) == (set(), set())
+    check(store)
+    del before[middle[0]]
+    assert state(store) == before
+
+
+def test_a_market_dropped_and_added_again_starts_afresh():
+    store = make_store()
+    btc = [sub("BTC-PERP", "tick_5_1"), sub("BTC-PERP", "volume_2_1")]
+    assert store.reconcile(unsubscribe=btc) == (set(), {"BTC-PERP"})
+    check(store)
+    assert "BTC-PERP" not in store.markets
+
+    added, removed = store.reconcile(subscribe=btc[:1], prices={"BTC-PERP": 120.0})
+    assert (added, removed) == ({"BTC-PERP"}, set())
+    check(store)
+    assert state(store)[btc[0][0]] == (0.0, 0.0, 120.0, [1])
+
+
+def test_unsubscribing_and_subscribing_a_key_in_one_batch_keeps_its_counter():
+    store = make_store()
+    before = state(store)
+    key = sub("SOL-PERP", "tick_1_1")
+    resub = sub("SOL-PERP", "tick_1_1", "u2", 3)
+    assert store.reconcile(subscribe=[resub], unsubscribe=[key]) == (set(), set())
+    check(store)
+    count, cusum_count, last_agg_price, _ = before[key[0]]
+    assert state(store)[key[0]] == (count, cusum_count, last_agg_price, [3])
+    assert store.users[store._index[key[0]]] == ["u2"]
+
+
+def test_a_new_key_joins_its_bar_series():
+    store = make_store()
+    row = store._index[sub("BTC-PERP", "tick_5_1")[0]]
+    joined = sub("BTC-PERP", "tick_5_3")
+    store.reconcile(subscribe=[joined], prices={"BTC-PERP": 999.0})
+    check(store)
+    assert state(store)[joined[0]] == (store.count[row], 0.0, store.last_agg_price[row], [1])
+    assert store._series[("BTC-PERP", "tick", 5.0)] == {
+        sub("BTC-PERP", "tick_5_1")[0],
+        joined[0],
+    }
+
+    # a new agg_unit is a new series, starting from the market's price
+    fresh = sub("BTC-PERP", "tick_7_1")
+    store.reconcile(subscribe=[fresh], prices={"BTC-PERP": 999.0})
+    assert state(store)[fresh[0]] == (0.0, 0.0, 999.0, [1])
+
+
+def test_untouched_counters_keep_their_state():
+    store = make_store()
+    before = state(store)
+    dropped = sub("ETH-PERP", "dollar_100_2", chat=2)
+    added = sub("SOL-PERP", "volume_3_1")
+    # another chat joining an existing watch doesn't touch its counts either
+    shared = sub("BTC-PERP", "volume_2_1", "u2", 2)
+    store.reconcile(subscribe=[added, shared], unsubscribe=[dropped], prices={"SOL-PERP": 2.0})
+    check(store)
+
+    after = state(store)
+    del before[dropped[0]]
+    before[shared[0]] = before[shared[0]][:3] + ([1, 2],)
+    del after[added[0]]
+    assert after == before
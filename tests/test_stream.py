@@ -0,0 +1,320 @@
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from watcher.cusum import CUSUM
+from watcher.metrics import Metrics
+from watcher.stream import TradeStream
+from watcher.trades import to_trades
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+class FakeFtx:
+    """a local websocket speaking just enough of the ftx protocol: it records every op sent to it"""
+
+    def __init__(self):
+        self.ops = []
+        self.connections = []
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.url = "ws://127.0.0.1:{}/ws/".format(self.server.getsockname()[1])
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            request += conn.recv(1024)
+        key = [
+            line.split(":", 1)[1].strip()
+            for line in request.decode().split("\r\n")
+            if line.lower().startswith("sec-websocket-key")
+        ][0]
+        accept = base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+        conn.sendall(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                "Connection: Upgrade\r\nSec-WebSocket-Accept: {}\r\n\r\n".format(accept)
+            ).encode()
+        )
+        self.connections.append(conn)
+        try:
+            while True:
+                opcode, payload = self._read_frame(conn)
+                if opcode == 8:
+                    conn.sendall(bytes([0x88, 0]))
+                    return
+                if opcode == 1:
+                    self.ops.append(json.loads(payload))
+        except (OSError, ConnectionError):
+            return
+
+    def _read_frame(self, conn):
+        def read(n):
+            data = b""
+            while len(data) < n:
+                chunk = conn.recv(n - len(data))
+                if not chunk:
+                    raise ConnectionError
+                data += chunk
+            return data
+
+        head, size = read(2)
+        size &= 0x7F
+        if size == 126:
+            size = struct.unpack(">H", read(2))[0]
+        elif size == 127:
+            size = struct.unpack(">Q", read(8))[0]
+        mask = read(4)
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(read(size)))
+        return head & 0x0F, payload
+
+    def send(self, message):
+        """sends a text frame to the latest connection"""
+        data = json.dumps(message).encode()
+        if len(data) < 126:
+            head = bytes([0x81, len(data)])
+        else:
+            head = bytes([0x81, 126]) + struct.pack(">H", len(data))
+        self.connections[-1].sendall(head + data)
+
+    def trades(self, market, *ids):
+        self.send(
+            {
+                "channel": "trades",
+                "market": market,
+                "type": "update",
+                "data": [
+                    {
+                        "id": id,
+                        "time": "2022-03-01T12:58:{:02d}+00:00".format(id),
+                        "price": 100.0 + id,
+                        "size": 1.0,
+                        "side": "buy",
+                        "liquidation": False,
+                    }
+                    for id in ids
+                ],
+            }
+        )
+
+    def drop(self):
+        """cuts the latest connection without a close handshake"""
+        self.connections[-1].shutdown(socket.SHUT_RDWR)
+        self.connections[-1].close()
+
+    def close(self):
+        self.server.close()
+
+
+def rest_trades(*ids):
+    """what the REST fill brings back: trades stamped as FakeFtx.trades stamps them"""
+    ids = np.array(ids, dtype=np.int64)
+    return to_trades(
+        ids,
+        np.datetime64("2022-03-01T12:58:00", "ns").astype(np.int64) + ids * 10**9,
+        100.0 + ids,
+        np.ones(len(ids)),
+        np.ones(len(ids)),
+        np.zeros(len(ids), dtype=bool),
+    )
+
+
+def wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def ftx():
+    ftx = FakeFtx()
+    yield ftx
+    ftx.close()
+
+
+def test_stream_subscribes_batches_and_flags_reconnects(ftx):
+    stream = TradeStream(["BTC-PERP", "ETH-PERP"], url=ftx.url, ping_interval=0)
+    stream.start()
+    try:
+        wait_for(lambda: len(ftx.ops) == 2)
+        assert sorted(op["market"] for op in ftx.ops) == ["BTC-PERP", "ETH-PERP"]
+        assert {(op["op"], op["channel"]) for op in ftx.ops} == {("subscribe", "trades")}
+        # the first connect asks for a REST fill too
+        assert stream.reconnected.is_set()
+        stream.reconnected.clear()
+
+        # everything queued by the time it's asked for comes back as one batch per market
+        assert stream.batches(timeout=0.05) == {}
+        ftx.trades("BTC-PERP", 1, 2)
+        ftx.trades("ETH-PERP", 3)
+        ftx.trades("BTC-PERP", 4)
+        ftx.send({"channel": "trades", "market": "BTC-PERP", "type": "subscribed"})
+        wait_for(lambda: stream.trades.qsize() == 3)
+        batch = stream.batches(timeout=1)
+        assert {market: [x["id"] for x in trades] for market, trades in batch.items()} == {
+            "BTC-PERP": [1, 2, 4],
+            "ETH-PERP": [3],
+        }
+
+        stream.resubscribe(["BTC-PERP", "SOL-PERP"])
+        wait_for(lambda: len(ftx.ops) == 4)
+        assert {(op["op"], op["market"]) for op in ftx.ops[2:]} == {
+            ("subscribe", "SOL-PERP"),
+            ("unsubscribe", "ETH-PERP"),
+        }
+
+        # a dropped connection comes back subscribed to the current markets, flagged for a fill
+        ftx.drop()
+        wait_for(lambda: len(ftx.ops) == 6)
+        assert stream.reconnected.is_set()
+        assert sorted(op["market"] for op in ftx.ops[4:]) == ["BTC-PERP", "SOL-PERP"]
+        # and hands out nothing past the reconnect until it's asked again (after the fill)
+        ftx.trades("SOL-PERP", 5)
+        assert stream.batches(timeout=1) == {}
+        assert list(stream.batches(timeout=1)) == ["SOL-PERP"]
+    finally:
+        stream.stop()
+
+
+class StreamWatcher(CUSUM):
+    """
+    a CUSUM with just the stream loop. Its REST fill serves rest[market] (waiting on hung[market]
+    first, if there is one) and it records every fill and what each count saw
+    """
+
+    def __init__(self, stream, interval=3600):
+        self.stream = stream
+        self.stopped = threading.Event()
+        self.interval = interval
+        self.metrics = Metrics()
+        self.pool = ThreadPoolExecutor(max_workers=4)
+        self.pending = {"live": {}, "bootstrap": {}}
+        self.cache = {market: self._new_entry() for market in stream.markets}
+        for entry in self.cache.values():
+            entry["last_price"] = 100.0
+        self.rest = {market: rest_trades() for market in self.cache}
+        self.hung = {}
+        self.calls = []
+        self.errors = []
+        self.reporter = self
+
+    def report(self, e, where=None):
+        self.errors.append(e)
+
+    def _pull_market(self, market, now):
+        if market in self.hung:
+            self.hung[market].wait()
+        return self.rest[market]
+
+    def _update_cache(self, markets=None, timeout=None):
+        self.calls.append(("fill", sorted(markets)))
+        return super()._update_cache(markets, timeout=timeout)
+
+    def _update_counts(self, markets=None):
+        trades = {market: self.cache[market]["txs"]["id"].tolist() for market in markets}
+        self.calls.append(("count", trades))
+
+    def _send_pings(self):
+        pass
+
+    def counts(self, market):
+        """the ids each count of a market saw"""
+        return [ids[market] for call, ids in self.calls if call == "count" and market in ids]
+
+
+@pytest.fixture
+def watch(ftx):
+    """runs a StreamWatcher's loop against the local websocket"""
+    watchers = []
+
+    def watch(markets, **kwargs):
+        stream = TradeStream(markets, url=ftx.url, ping_interval=0)
+        watcher = StreamWatcher(stream, **kwargs)
+        loop = threading.Thread(target=watcher._stream_loop, args=(time.time() + 3600,))
+        watcher.loop = loop
+        watchers.append((watcher, loop))
+        stream.start()
+        loop.start()
+        return watcher
+
+    yield watch
+    for watcher, loop in watchers:
+        for event in watcher.hung.values():
+            event.set()
+        watcher.stop()
+        watcher.stream.stop()
+        loop.join(timeout=5)
+        watcher.pool.shutdown()
+
+
+def test_a_reconnect_triggers_a_rest_gap_fill(ftx, watch):
+    watcher = watch(["BTC-PERP", "ETH-PERP"])
+    # connecting fills every market over REST before anything is counted off the stream
+    wait_for(lambda: len(ftx.ops) == 2 and len(watcher.calls) == 2)
+    assert watcher.calls[0] == ("fill", ["BTC-PERP", "ETH-PERP"])
+    assert watcher.calls[1] == ("count", {"BTC-PERP": [], "ETH-PERP": []})
+
+    ftx.trades("BTC-PERP", 1, 2)
+    wait_for(lambda: len(watcher.calls) == 3)
+    assert watcher.calls[2] == ("count", {"BTC-PERP": [1, 2]})
+
+    # what traded while disconnected comes over REST, before the stream's trades after it
+    watcher.rest["ETH-PERP"] = rest_trades(3, 4)
+    ftx.drop()
+    wait_for(lambda: len(ftx.ops) == 4 and len(watcher.calls) == 5)
+    assert watcher.calls[3] == ("fill", ["BTC-PERP", "ETH-PERP"])
+    ftx.trades("ETH-PERP", 4, 5)
+    wait_for(lambda: len(watcher.calls) == 6)
+    assert watcher.counts("ETH-PERP")[-2:] == [[3, 4], [5]]
+    assert watcher.errors == []
+
+
+def test_a_fill_that_misses_the_deadline_holds_the_market_back(ftx, watch):
+    watcher = watch(["BTC-PERP", "ETH-PERP"], interval=0.4)
+    watcher.rest = {"BTC-PERP": rest_trades(1, 2, 3), "ETH-PERP": rest_trades(1, 2, 3)}
+    watcher.hung["ETH-PERP"] = threading.Event()
+
+    # BTC's gap lands in time, ETH's doesn't
+    wait_for(lambda: watcher.counts("BTC-PERP") == [[1, 2, 3]])
+    assert watcher.counts("ETH-PERP") == []
+
+    # so ETH's stream trades wait for its fill while BTC carries on
+    ftx.trades("ETH-PERP", 10, 11)
+    ftx.trades("BTC-PERP", 12)
+    wait_for(lambda: watcher.counts("BTC-PERP") == [[1, 2, 3], [12]])
+    time.sleep(0.2)
+    assert watcher.counts("ETH-PERP") == [] and watcher.cache["ETH-PERP"]["last_id"] is None
+
+    # the fill is retried every pass, and once it lands the gap is counted before the held trades
+    watcher.hung["ETH-PERP"].set()
+    wait_for(lambda: len(watcher.counts("ETH-PERP")) == 2)
+    assert watcher.counts("ETH-PERP") == [[1, 2, 3], [10, 11]]
+    assert watcher.cache["ETH-PERP"]["last_id"] == 11
+    assert watcher.errors == []
+
+
+def test_stop_wakes_a_waiting_loop(ftx, watch):
+    watcher = watch(["BTC-PERP"])
+    wait_for(lambda: len(watcher.counts("BTC-PERP")) == 1)
+    # the loop is waiting on a batch until its next sync, an hour away
+    watcher.stop()
+    watcher.loop.join(timeout=1)
+    assert not watcher.loop.is_alive()
@@ -0,0 +1,142 @@
+import copy
+
+import pytest
+from pymongo.errors import PyMongoError
+
+from watcher.sync import CollectionSync
+
+
+class ChangeStream:
+    def __init__(self):
+        self.changes = []
+        self.broken = False
+
+    def try_next(self):
+        if self.broken:
+            raise PyMongoError("stream lost")
+        return self.changes.pop(0) if self.changes else None
+
+
+class Collection:
+    """
+    just enough of a pymongo collection: find on {}, updatedAt $exists / $gte, and (with streams)
+    a change stream fed by every write
+    """
+
+    def __init__(self, docs=(), streams=True):
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.streams = streams
+        self.watchers = []
+        self.finds = []
+
+    def find(self, query={}):
+        self.finds.append(query)
+        docs = list(self.docs.values())
+        if "updatedAt" in query:
+            cond = query["updatedAt"]
+            docs = [doc for doc in docs if doc.get("updatedAt") is not None]
+            if "$gte" in cond:
+                docs = [doc for doc in docs if doc["updatedAt"] >= cond["$gte"]]
+        return copy.deepcopy(docs)
+
+    def watch(self, full_document=None):
+        if not self.streams:
+            raise PyMongoError("not a replica set")
+        stream = ChangeStream()
+        self.watchers.append(stream)
+        return stream
+
+    def write(self, doc, quiet=False):
+        """inserts or replaces a document. quiet skips the change stream (as a missed event)"""
+        op = "replace" if doc["_id"] in self.docs else "insert"
+        self.docs[doc["_id"]] = doc
+        self._notify(op, doc["_id"], doc, quiet)
+
+    def delete(self, key, quiet=False):
+        del self.docs[key]
+        self._notify("delete", key, None, quiet)
+
+    def _notify(self, op, key, doc, quiet):
+        if quiet:
+            return
+        for stream in self.watchers:
+            change = {"operationType": op, "documentKey": {"_id": key}}
+            if doc is not None:
+                change["fullDocument"] = copy.deepcopy(doc)
+            stream.changes.append(change)
+
+
+def doc(key, value, stamp=None):
+    doc = {"_id": key, "value": value}
+    if stamp is not None:
+        doc["updatedAt"] = stamp
+    return doc
+
+
+def test_load_reads_every_document():
+    collection = Collection([doc(1, "a"), doc(2, "b")])
+    sync = CollectionSync(collection)
+    assert sync.load() == {1: doc(1, "a"), 2: doc(2, "b")}
+    assert sync.stream is not None
+    assert sync.poll() == {}
+
+
+def test_changes_are_drained_from_the_stream():
+    collection = Collection([doc(1, "a"), doc(2, "b")])
+    sync = CollectionSync(collection)
+    sync.load()
+    collection.write(doc(1, "a2"))
+    collection.write(doc(3, "c"))
+    collection.delete(2)
+    collection.write(doc(1, "a3"))
+
+    assert sync.poll() == {
+        1: (doc(1, "a"), doc(1, "a3")),
+        2: (doc(2, "b"), None),
+        3: (None, doc(3, "c")),
+    }
+    assert sync.docs == {1: doc(1, "a3"), 3: doc(3, "c")}
+    # nothing new, and the collection was never re-read
+    assert sync.poll() == {} and collection.finds == [{}]
+
+
+def test_a_lost_stream_falls_back_to_a_resync():
+    collection = Collection([doc(1, "a")])
+    sync = CollectionSync(collection)
+    sync.load()
+    collection.write(doc(1, "a2"), quiet=True)
+    collection.watchers[0].broken = True
+
+    assert sync.poll() == {1: (doc(1, "a"), doc(1, "a2"))}
+    assert len(collection.watchers) == 2  # and a new stream is opened
+
+
+def test_without_a_stream_changes_are_found_by_updated_at():
+    collection = Collection([doc(1, "a", stamp=10), doc(2, "b", stamp=20)], streams=False)
+    sync = CollectionSync(collection)
+    sync.load()
+    assert sync.stream is None and sync.since == 20
+
+    collection.write(doc(1, "a2", stamp=30))
+    collection.write(doc(3, "c", stamp=31))
+    assert sync.poll() == {1: (doc(1, "a", 10), doc(1, "a2", 30)), 3: (None, doc(3, "c", 31))}
+    assert collection.finds[-1] == {"updatedAt": {"$gte": 20}}
+    assert sync.since == 31
+    # the newest document is found again by $gte, but it hasn't changed
+    assert sync.poll() == {}
+
+
+@pytest.mark.parametrize("streams", [True, False])
+def test_a_resync_finds_what_the_poll_missed(streams):
+    collection = Collection([doc(1, "a", stamp=10), doc(2, "b", stamp=10)], streams=streams)
+    sync = CollectionSync(collection, resync_every=3)
+    sync.load()
+    # a deletion and an edit without a stamp aren't seen by the updatedAt fallback (nor by a
+    # stream that missed them)
+    collection.delete(2, quiet=True)
+    collection.write(doc(1, "a2"), quiet=True)
+
+    assert sync.poll() == {}
+    assert sync.poll() == {}
+    assert sync.poll() == {1: (doc(1, "a", 10), doc(1, "a2")), 2: (doc(2, "b", 10), None)}
+    assert sync.docs == {1: doc(1, "a2")}
@@ -0,0 +1,165 @@
+"""
+Streaming tick, volume and dollar bars.
+
+Takes batches of trades and emits the bars they complete, carrying the partial bar (the
+fractional count) across batches. bar_closes is the vectorised hot path - it forms bars for many
+series at once and is what the live watcher's engine runs. BarGenerator wraps it for a single
+series, for offline replay and backtests.
+
+A bar closes every agg_unit of the measure (1 per tick, size for volume, size * price for dollar).
+Its close is the price of the last trade at or before that point, or the previous batch's last
+price if the point lies before the batch's first trade.
+
+The carried count is rounded to 7 digits, as the original counter did (the engine has to match
+it). That rounding can move a close by a trade depending on how the trades were batched, so a
+backtest only reproduces the live hits if it feeds in the same batches the watcher saw (replay.py
+cuts its tape into the live cycles for this).
+
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+AGG_TYPES = ["tick", "volume", "dollar"]
+
+BAR_DTYPE = np.dtype(
+    [
+        ("time", np.int64),  # epoch ns of the closing trade
+        ("close", np.float64),
+        ("move", np.float64),  # abs % change from the previous close
+    ]
+)
+
+Bars = namedtuple("Bars", ["count", "last_agg_price", "close", "index", "move", "starts", "lens"])
+
+
+def _py_round(values, ndigits=7):
+    """python's round() is correctly rounded while np.round is not, so keep the reference rounding"""
+    return np.array([round(x, ndigits) for x in values.tolist()], dtype=np.float64)
+
+
+def cumulative(trades, agg_type):
+    """the running tick/volume/dollar measure of a batch of trades (TRADE_DTYPE)"""
+    if agg_type == "tick":
+        return np.arange(1, len(trades) + 1)
+    if agg_type == "volume":
+        return np.cumsum(trades["size"])
+    return np.cumsum(trades["dollar"])
+
+
+def bar_closes(cum, price, count, last_agg_price, agg_unit, last_price):
+    """
+    forms the bar closes of a batch of bar series sharing one market and agg_type
+
+    takes:
+        cum - cumulative measure of the new txs (see cumulative), ascending
+        price - price of each new tx
+        count, last_agg_price, agg_unit - series state, one entry per series
+        last_price - the market's last price before this batch, used when an aggregation point
+                     lies before the first new tx
+
+    returns Bars:
+        count, last_agg_price - the new series state
+        close, index, move - every bar close (oldest first): its price, the index of its trade
+                             in the batch (-1 if it fell back to last_price) and its abs % move
+        starts, lens - series i's bars are the lens[i] entries from starts[i]
+    """
+
+    cum = np.asarray(cum)
+    price = np.asarray(price, dtype=np.float64)
+    agg_unit = np.asarray(agg_unit, dtype=np.float64)
+    last_agg_price = np.array(last_agg_price, dtype=np.float64)
+    lens = np.zeros(len(agg_unit), dtype=np.int64)
+    starts = np.zeros(len(agg_unit), dtype=np.int64)
+    empty = np.zeros(0)
+
+    if len(cum) == 0:
+        count = np.array(count, dtype=np.float64)
+        return Bars(count, last_agg_price, empty, empty.astype(np.int64), empty, starts, lens)
+
+    top = cum[-1]
+    count = np.asarray(count, dtype=np.float64) + top / agg_unit
+
+    # this is the number of aggregation points we need to make for each series
+    multiples = np.floor_divide(count, 1).astype(np.int64)
+    live = np.flatnonzero(multiples > 0)
+    if len(live) == 0:
+        return Bars(count, last_agg_price, empty, empty.astype(np.int64), empty, starts, lens)
+
+    lens[live] = multiples[live]
+    starts[live] = np.concatenate(([0], np.cumsum(lens[live])[:-1]))
+    rem = _py_round(count[live] - lens[live])
+    owner = np.repeat(live, lens[live])
+
+    # walk each series' points oldest first (the reference sorts them ascending)
+    x = lens[owner] - 1 - (np.arange(lens.sum()) - starts[owner])
+    pos = top - (np.repeat(rem, lens[live]) + x) * agg_unit[owner]
+
+    idx = np.searchsorted(cum, pos, side="right") - 1
+    found = idx >= 0
+    found[found] = cum[idx[found]] != 0
+    close = np.where(found, price[np.maximum(idx, 0)], last_price)
+
+    prev = np.empty_like(close)
+    prev[1:] = close[:-1]
+    prev[starts[live]] = last_agg_price[live]
+    move = np.abs(close / prev - 1) * 100
+
+    last_agg_price[live] = close[starts[live] + lens[live] - 1]
+    count[live] = rem
+
+    return Bars(count, last_agg_price, close, np.where(found, idx, -1), move, starts, lens)
+
+
+class BarGenerator:
+    def __init__(self, agg_type, agg_unit, count=0.0, last_close=None):
+        """
+        Emits the bars of one series as trade batches are fed in
+        agg_type - tick, volume or dollar
+        agg_unit - how much of the measure makes a bar
+        count - the partial bar carried in (in bars)
+        last_close - the previous bar's close (defaults to the first trade's price)
+        """
+        if agg_type not in AGG_TYPES:
+            raise ValueError("agg_type must be one of {}".format(AGG_TYPES))
+        self.agg_type = agg_type
+        self.agg_unit = float(agg_unit)
+        self.count = float(count)
+        self.last_close = last_close
+        self.last_price = None
+        self.last_time = None
+
+    def update(self, trades):
+        """
+        feeds in a batch of trades (TRADE_DTYPE, sorted by time) and returns the bars it completed
+        as a BAR_DTYPE array
+        """
+        if len(trades) == 0:
+            return np.zeros(0, dtype=BAR_DTYPE)
+        if self.last_close is None:
+            self.last_close = float(trades["price"][0])
+        if self.last_price is None:
+            self.last_price, self.last_time = self.last_close, int(trades["time"][0])
+
+        bars = bar_closes(
+            cumulative(trades, self.agg_type),
+            trades["price"],
+            [self.count],
+            [self.last_close],
+            [self.agg_unit],
+            self.last_price,
+        )
+
+        out = np.empty(len(bars.close), dtype=BAR_DTYPE)
+        out["time"] = np.where(
+            bars.index >= 0, trades["time"][np.maximum(bars.index, 0)], self.last_time
+        )
+        out["close"] = bars.close
+        out["move"] = bars.move
+
+        self.count = float(bars.count[0])
+        self.last_close = float(bars.last_agg_price[0])
+        self.last_price = float(trades["price"][-1])
+        self.last_time = int(trades["time"][-1])
+        return out
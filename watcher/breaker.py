@@ -0,0 +1,63 @@
+"""
+Per-market circuit breakers for the exchange fetches.
+
+A market whose fetches keep failing is left alone for a while instead of being retried every
+cycle, backing off exponentially (with jitter, so a whole exchange outage doesn't come back as one
+burst of retries) while the failures continue. Once the wait is up a single fetch is let through -
+if that works the market is back to normal, otherwise it waits twice as long.
+
+Each market has its own breaker, so one broken symbol never holds up the rest.
+
+"""
+
+import random
+import time
+
+
+def backoff(attempt, base, cap):
+    """the wait before retry number attempt (from 1): doubling from base up to cap, half jittered"""
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class Breaker:
+    def __init__(self, threshold=3, base=10, cap=300):
+        """
+        threshold - how many failures in a row open the breaker
+        base, cap - the first and longest wait (seconds) while it's open
+        """
+        self.threshold = threshold
+        self.base = base
+        self.cap = cap
+        self.failures = 0
+        self.opens = 0  # how many times in a row it has opened
+        self.until = 0
+
+    @property
+    def state(self):
+        if self.opens == 0:
+            return "closed"
+        return "open" if time.monotonic() < self.until else "half-open"
+
+    def allow(self):
+        """whether the market can be fetched right now"""
+        return time.monotonic() >= self.until
+
+    def success(self):
+        self.failures = 0
+        self.opens = 0
+        self.until = 0
+
+    def failure(self):
+        """
+        counts a failed fetch and returns the seconds the breaker is now open for (0 if it
+        isn't). A failure while half-open opens it again straight away, for longer
+        """
+        self.failures += 1
+        if self.failures < self.threshold and self.opens == 0:
+            return 0
+        self.failures = 0
+        self.opens += 1
+        wait = backoff(self.opens, self.base, self.cap)
+        self.until = time.monotonic() + wait
+        return wait
@@ -0,0 +1,95 @@
+"""
+Checkpoints of the watcher's state.
+
+The counter state and the per-market cursors are snapshotted to a compact .npz file (and
+optionally to mongo) so a restart can pick up where it left off and only replay the trades
+since the snapshot.
+
+"""
+
+import os
+
+import numpy as np
+
+from .store import AGG_TYPES
+
+
+def snapshot(counter, cache):
+    """flattens the counter store and the market cursors (times in epoch ns) into a dict of arrays"""
+    cursors = [market for market in cache if cache[market].get("last_time") is not None]
+    return {
+        "market": np.array([counter.markets[x] for x in counter.market], dtype=str),
+        "agg_type": np.array([AGG_TYPES[x] for x in counter.agg_type], dtype=str),
+        "agg_unit": counter.agg_unit,
+        "agg_perc": counter.agg_perc,
+        "count": counter.count,
+        "cusum_count": counter.cusum_count,
+        "last_agg_price": counter.last_agg_price,
+        "cursor_market": np.array(cursors, dtype=str),
+        "last_id": np.array([cache[x]["last_id"] for x in cursors], dtype=np.int64),
+        "last_time": np.array([cache[x]["last_time"] for x in cursors], dtype=np.int64),
+        "last_price": np.array([cache[x]["last_price"] for x in cursors], dtype=np.float64),
+    }
+
+
+def save_checkpoint(state, path=None, mongo=None):
+    """writes a snapshot atomically to path and/or upserts it into mongo"""
+    if path is not None:
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **state)
+        os.replace(tmp, path)
+    if mongo is not None:
+        mongo["cusum"].checkpoints.replace_one(
+            {"_id": "watcher"},
+            {"_id": "watcher", **{key: value.tolist() for key, value in state.items()}},
+            upsert=True,
+        )
+
+
+def load_checkpoint(path=None, mongo=None):
+    """reads the snapshot back from path, falling back to mongo. Returns None if there isn't one"""
+    if path is not None and os.path.exists(path):
+        with np.load(path) as f:
+            return {key: f[key] for key in f.files}
+    if mongo is not None:
+        doc = mongo["cusum"].checkpoints.find_one({"_id": "watcher"})
+        if doc is not None:
+            del doc["_id"]
+            return {key: np.array(value) for key, value in doc.items()}
+    return None
+
+
+def restore_counter(counter, state):
+    """
+    copies the saved count, cusum_count and last_agg_price onto the matching counters
+    Counters that weren't in the snapshot are left alone
+    """
+    saved = {
+        key: i
+        for i, key in enumerate(
+            zip(
+                state["market"].tolist(),
+                state["agg_type"].tolist(),
+                state["agg_unit"].tolist(),
+                state["agg_perc"].tolist(),
+            )
+        )
+    }
+    rows = []
+    found = []
+    for row, key in enumerate(
+        zip(
+            [counter.markets[x] for x in counter.market],
+            [AGG_TYPES[x] for x in counter.agg_type],
+            counter.agg_unit.tolist(),
+            counter.agg_perc.tolist(),
+        )
+    ):
+        if key in saved:
+            rows.append(row)
+            found.append(saved[key])
+    counter.count[rows] = state["count"][found]
+    counter.cusum_count[rows] = state["cusum_count"][found]
+    counter.last_agg_price[rows] = state["last_agg_price"][found]
+    return len(rows)
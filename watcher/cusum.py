@@ -6,307 +6,446 @@ to ping notifications or trade events!
 
 """
 
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import numpy as np
 import pandas as pd
+from ccxt.base.errors import RequestTimeout
+from requests.adapters import HTTPAdapter
 from common.bot_debug import *
 from common.connection import get_connections
+from common.digest import Digest
+from common.dispatcher import TELEGRAM_API, Dispatcher
 from common.misc import *
+from common.outbox import Outbox
+from common.ratelimit import TokenBucket
+from common.reporter import CrashReporter
 from exchanges.ftx_rest import ftx
 
-from .utils import *
+from .bars import AGG_TYPES, cumulative
+from .breaker import Breaker, backoff
+from .checkpoint import load_checkpoint, restore_counter, save_checkpoint, snapshot
+from .engine import trickle
+from .hitlog import HitLog
+from .ingest import fetch_all
+from .latency import LatencyTracker
+from .levels import LevelIndex, format_range
+from .metrics import Metrics
+from .store import CounterStore, subscriptions
+from .stream import FTX_WS, TradeStream
+from .sync import CollectionSync
+from .trades import TRADE_DTYPE, to_trades
 
 
 class CUSUM(ftx):
-    def __init__(self, interval=10):
+    def __init__(
+        self,
+        interval=10,
+        overlap=5,
+        workers=16,
+        checkpoint="watcher_state.npz",
+        checkpoint_every=30,
+        checkpoint_mongo=False,
+        metrics_port=None,
+        show_delay=False,
+        slow_alert=30,
+        telegram_api=TELEGRAM_API,
+        outbox="outbox.jsonl",
+        digest_window=30,
+        retries=3,
+        hitlog="hits.jsonl",
+    ):
         """
         First, inherit the functions from the ftx module.
         Then, grab the newest version of the watchlists from mongo.
         Instantiate a cache of crypto prices.
-        Find the price to start from - (initial conditions).
-        Record the most recent transactions so we can make an accurate comparison first time around
-        Get some stats for these txs.
-        Instantiate the counter df.
+        Restore the counters and market cursors from the last checkpoint, if there is one.
+        Find the price to start from for everything else - (initial conditions).
+        Record the most recent transaction of every market (one small request each, all at once)
+        so we have a starting price and a cursor to count from.
+        Seed the counter store with the last prices.
+
+        overlap is how many seconds before each market's cursor we re-fetch to catch late trades
+        workers is how many markets are fetched at once. They share the pooled session and one
+        token bucket sized from the exchange's rateLimit.
+        checkpoint is the file the state is saved to every checkpoint_every cycles and on
+        shutdown (None to turn it off). checkpoint_mongo also keeps a copy in mongo.
+        metrics_port serves the loop's timings and counts for Prometheus on localhost (None for
+        off).
+        show_delay adds the time since the triggering bar closed to each notification.
+        slow_alert is how many seconds from bar close to send before an alert is logged as slow.
+        telegram_api is where notifications are posted. They are sent in the background by a
+        dispatcher, so the loop never waits on telegram.
+        outbox is the file every notification is written to before it's sent, so nothing is lost
+        to a failed send or a crash (None to turn it off). Whatever is left in it is sent first
+        thing on the next run.
+        digest_window is the least seconds between messages to a chat. A chat's first hit is sent
+        straight away and the ones after it are held and sent as one digest (0 to send every cycle).
+        retries is how many times a market's fetch is tried in a cycle (a timeout isn't retried).
+        A market that keeps failing is skipped for a while (see breaker.py) and the others carry on
+        without it. Errors are reported to the admin through a rate-limited reporter. The cycle
+        waits at most half an interval for its fetches - a market that hangs sits the cycle out
+        with its cursor untouched (see ingest.py).
+        hitlog is the file every hit is logged to as a json line, from a background thread and
+        rotated daily or at 64MB (None to turn it off). See hitlog.read_hits to load it back.
 
         """
         super().__init__()
         self.interval = interval
+        self.overlap = overlap
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_mongo = checkpoint_mongo
+        self.cycles = 0
+        self.stopped = threading.Event()
+        self.metrics = Metrics()
+        if metrics_port is not None:
+            self.metrics.serve(metrics_port)
+        self.show_delay = show_delay
+        self.latency = LatencyTracker(slow=slow_alert, metrics=self.metrics)
+        self.dispatcher = Dispatcher(BOT_TOKEN, api=telegram_api)
+        self.outbox = None if outbox is None else Outbox(outbox)
+        self.digest = Digest(digest_window)
+        self.traces = {}  # outbox key -> the hit's timestamps, until it's delivered
+        self.retries = retries
+        self.hitlog = None if hitlog is None else HitLog(hitlog)
+        self.breakers = {}
+        self.pending = {"live": {}, "bootstrap": {}}  # market -> fetch still running, per kind
+        self.reporter = CrashReporter(
+            lambda text: self.dispatcher.submit(BOT_ADMIN, "BOT CRASH: " + text)
+        )
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.bucket = TokenBucket(1000 / self.rateLimit)
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        # ccxt's load_markets isn't thread-safe, so the market list is loaded once up front rather
+        # than by every worker racing on the first fetches
+        self.load_markets()
+        self.levels = LevelIndex(get_connections("mongo", "cusum")["archive"].keyPriceLevels)
         self._update_mongo_watchlist()
 
-        self.cache = {
-            market_name: {"txs": pd.DataFrame(), "last_id": None, "last_time": None}
-            for market_name in self.counter["market"].unique()
+        self.cache = {market_name: self._new_entry() for market_name in self.counter.markets}
+
+        self.restored = self._restore()
+        self._bootstrap(
+            [market for market in self.cache if self.cache[market]["last_time"] is None]
+        )
+        self.counter.fill_prices(
+            {market: self.cache[market].get("last_price") for market in self.cache}
+        )
+
+    def _new_entry(self):
+        """
+        an empty cache entry: the current cycle's new txs, their cumulative measures and the
+        market's cursor
+        """
+        txs = np.zeros(0, dtype=TRADE_DTYPE)
+        return {
+            "txs": txs,
+            "cum": {agg_type: cumulative(txs, agg_type) for agg_type in AGG_TYPES},
+            "last_id": None,
+            "last_time": None,
         }
 
-        now = datetime.now().timestamp() * 1000
+    def _checkpoint_conn(self):
+        return get_connections("mongo", "cusum") if self.checkpoint_mongo else None
+
+    def _restore(self):
+        """loads the last checkpoint (if any) onto the counters and the market cursors"""
 
-        init_pulls = {}
-        for market in list(self.cache.keys()):
-            init_pulls[market] = self._pull_txs(market, now, extra=1000000000)
+        state = load_checkpoint(self.checkpoint, self._checkpoint_conn())
+        if state is None:
+            return False
 
-        for market in list(self.cache.keys()):
-            self.cache[market]["txs"] = init_pulls[market]
+        for market, last_id, last_time, last_price in zip(
+            state["cursor_market"].tolist(),
+            state["last_id"].tolist(),
+            state["last_time"].tolist(),
+            state["last_price"].tolist(),
+        ):
+            if market in self.cache:
+                self.cache[market]["last_id"] = last_id
+                self.cache[market]["last_time"] = last_time
+                self.cache[market]["last_price"] = last_price
 
-        self._update_cache_stats()
-        self.counter["last_agg_price"] = self.counter["market"].apply(
-            lambda x: self.cache[x]["txs"]["price"].iloc[-1]
+        cprint(
+            "yellow",
+            "restored {} counters from checkpoint".format(restore_counter(self.counter, state)),
         )
-        self.counter["hit"] = False
+        return True
+
+    def _checkpoint(self):
+        """snapshots the counters and market cursors"""
+        if self.checkpoint is not None or self.checkpoint_mongo:
+            save_checkpoint(
+                snapshot(self.counter, self.cache), self.checkpoint, self._checkpoint_conn()
+            )
 
     def _update_mongo_watchlist(self):
 
         """
-        This reads the mongo collection of watchlists and updates the counter if new counts are added.
+        This picks up the watchlists that changed in mongo and updates the counter if new counts are
+        added. The first call reads the whole collection; after that only changed documents are
+        fetched (see sync.py) and only their watches are touched in the counter store.
         """
 
-        mongo = get_connections("mongo", "cusum")
+        if not hasattr(self, "watchlist"):
+            mongo = get_connections("mongo", "cusum")
+            self.watchlist = CollectionSync(mongo["cusum"].watchList)
+            self.counter = CounterStore(self.watchlist.load().values())
+            return
+
+        subscribe, unsubscribe = set(), set()
+        for old, new in self.watchlist.poll().values():
+            old = set() if old is None else subscriptions(old)
+            new = set() if new is None else subscriptions(new)
+            subscribe |= new - old
+            unsubscribe |= old - new
+        if len(subscribe) == 0 and len(unsubscribe) == 0:
+            return
+
+        print("watchlist changed! +{} -{}".format(len(subscribe), len(unsubscribe)))
+        prices = {
+            key[0]: self.cache[key[0]].get("last_price")
+            for key, _, _ in subscribe
+            if key[0] in self.cache
+        }
+        added, removed = self.counter.reconcile(subscribe, unsubscribe, prices)
 
-        pull = to_user_catalog([x for x in mongo["cusum"].watchList.find({})])
-        if hasattr(self, "counter"):
-            old = self.counter[
-                ["market", "agg_perc", "agg_type", "agg_unit", "users", "ids"]
-            ].to_dict("records")
-            new = pull[["market", "agg_perc", "agg_type", "agg_unit", "users", "ids"]].to_dict(
-                "records"
-            )
-            if old != new:
-                print("schema changed!")
-
-                self.counter = self.counter.merge(
-                    pull,
-                    how="right",
-                    on=["market", "agg_perc", "agg_type", "agg_unit"],
-                    suffixes=["_old", "_new"],
-                )
-                self.counter.fillna(0.0, inplace=True)
-                self.counter["users"] = self.counter["users_new"]
-                self.counter["count"] = self.counter["count_old"]
-                self.counter["cusum_count"] = self.counter["cusum_count_old"]
-                self.counter["last_agg_price"] = self.counter["last_agg_price_old"]
-                self.counter["ids"] = self.counter["ids_new"]
-                self.counter = self.counter[
-                    [
-                        "market",
-                        "users",
-                        "agg_perc",
-                        "agg_type",
-                        "agg_unit",
-                        "count",
-                        "cusum_count",
-                        "last_agg_price",
-                        "ids",
-                    ]
-                ]
+        for market in removed:
+            del self.cache[market]
+        if len(added) > 0:
+            self._add_markets(list(added))
 
-                self._fix_cache(self.counter["market"].unique())
-        else:
-            self.counter = pull
+    def _add_markets(self, markets):
 
-    def _fix_cache(self, cache_list):
+        """
+        Starts caching markets that were just added in mongo
+        """
+
+        for market in markets:
+            print(market)
+            self.cache[market] = self._new_entry()
+        self._bootstrap(markets)
 
+    def _bootstrap(self, markets):
         """
-        Accounts for changes to the cache that might have to be made if there is a new crypto added
-        in mongo
+        pulls the latest trade of each market (all at once) for a starting price and cursor, and
+        seeds their counters with the price
         """
 
         now = int(datetime.now().timestamp() * 1000)
-        for entry in self.cache:
-            if entry not in cache_list:
-                del self.cache[entry]
-
-        for entry in set(cache_list):
-            if entry not in list(self.cache.keys()):
-                print(entry)
-                self.cache[entry] = {"txs": self._pull_txs(entry, now, extra=1000000000)}
-                self.cache[entry]["last_id"] = self.cache[entry]["txs"]["id"].iloc[-1]
-                self.cache[entry]["last_time"] = self.cache[entry]["txs"]["time"].iloc[-1]
-                self.cache[entry]["last_price"] = self.cache[entry]["txs"]["price"].iloc[-1]
-
-                self.counter["last_agg_price"] = np.where(
-                    self.counter["market"] == entry,
-                    self.cache[entry]["last_price"],
-                    self.counter["last_agg_price"],
-                )
-
-        self.counter["tmp"] = self.counter[["market", "last_agg_price"]].to_dict("records")
-        self.counter["last_agg_price"] = self.counter["tmp"].map(lambda x: self._fill_price(**x))
-        del self.counter["tmp"]
+        pulls = fetch_all(
+            self.pool,
+            self._pull_txs,
+            markets,
+            now,
+            latest=True,
+            timeout=self.interval / 2,
+            pending=self.pending["bootstrap"],
+        )
 
-    def _pull_txs(self, market, now, extra=0):
-        """pulls transaction records from ftx and returns dataframe with added metrics"""
-        pull_not_succeeded = True
+        # markets that failed or didn't answer in time stay unpriced and are bootstrapped again
+        # next cycle
+        for market in markets:
+            trades = pulls.get(market)
+            self._ingest(market, np.zeros(0, dtype=TRADE_DTYPE) if trades is None else trades)
+        self._update_cache_stats(markets)
 
-        while pull_not_succeeded:
-            try:
-                pull = [
-                    x["info"]
-                    for x in self.fetch_trades(
-                        market,
-                        since=now
-                        - 1000 * 60 * 2
-                        - self.interval
-                        - extra,  # get the last 2 minutes of trades every interval
-                        until=now,
-                    )
-                ]
-                pull_not_succeeded = False
-            except Exception as e:
-                send_crash_report(e)
-                time.sleep(0.5)
+        self.counter.fill_prices(
+            {market: self.cache[market].get("last_price") for market in markets}
+        )
 
-        if len(pull) > 0:
-            pull = pd.DataFrame(pull)
-        else:
-            pull = pd.DataFrame(
-                columns=[
-                    "id",
-                    "price",
-                    "size",
-                    "side",
-                    "liquidation",
-                    "time",
-                    "dollar_amount",
-                ]
-            )
+    def _since(self, market, now):
+        """
+        where to start fetching a market from: its cursor less a small overlap for late trades.
+        Markets without a cursor yet get the last 2 minutes.
+        """
+        last_time = self.cache[market].get("last_time")
+        if last_time is None:
+            return now - 1000 * 60 * 2 - self.interval
+        return last_time // 1000000 - self.overlap * 1000
 
-        for label in ["price", "size"]:
-            pull[label] = pull[label].astype(float)
+    def _pull_market(self, market, now):
+        """the live fetch for one market: everything since its cursor, backfilled"""
+        return self._pull_txs(market, now, since=self._since(market, now), paginate=True)
 
-        pull["id"] = pull["id"].map(int)
-        pull["time"] = pull["time"].map(
-            lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%S.%f+00:00")
-        )
+    def throttle(self, cost=None):
+        """every request (from any worker) takes its share of the rateLimit budget from the bucket"""
+        self.bucket.acquire(1 if cost is None else cost)
 
-        pull["dollar"] = pull["size"] * pull["price"]
+    def _pull_txs(self, market, now, since=None, paginate=False, latest=False):
+        """
+        pulls transaction records from ftx and returns them as a structured trade array
+        With paginate, the window is backfilled page by page down to the market's last_id and the
+        fetch report (pages, rows, gap) is kept in the cache.
+        With latest, only the market's most recent trade is pulled (used to bootstrap).
+        A failed fetch is retried a few times (with a short jittered backoff) and then given up on
+        for this cycle - None comes back and the market's cursor stays put, so the next good
+        fetch picks up what was missed. A timeout isn't retried within the cycle. Its breaker
+        decides when it's tried again.
+        """
+        breaker = self.breakers.setdefault(market, Breaker())
 
-        return pull.sort_values(["time", "id"])
+        if since is None:
+            since = now - 1000 * 60 * 2 - self.interval
 
-    def _update_cache_stats(self):
-        """records the last measure from the cache"""
-        for market in list(self.cache.keys()):
-            if len(self.cache[market]["txs"]) > 0:
+        for attempt in range(1, self.retries + 1):
+            if not breaker.allow():
+                break
+            try:
+                if latest:
+                    pull = self.fetch_trades_raw(market, limit=1)
+                elif paginate:
+                    pull, report = self.fetch_trades_paginated(
+                        market, since, now, last_id=self.cache[market].get("last_id"), raw=True
+                    )
+                    self.cache[market]["fetch"] = report
+                    if report["gap"]:
+                        cprint("red", "possible gap in {} trades: {}".format(market, report))
+                else:
+                    pull = self.fetch_trades_raw(market, since=since, until=now)
+                breaker.success()
+                return to_trades(**pull)
+            except Exception as e:
+                self.metrics.fetch_errors.inc(1, market)
+                self.reporter.report(e, market)
+                wait = breaker.failure()
+                if wait > 0:
+                    cprint("red", "skipping {} for {:.0f}s: {}".format(market, wait, e))
+                elif isinstance(e, RequestTimeout):
+                    break  # another try would run past the cycle - next cycle picks it up
+                elif attempt < self.retries:
+                    time.sleep(backoff(attempt, 0.25, 2))
+
+        return None
+
+    def _parse_txs(self, pull):
+        """turns raw ftx trade dicts from the websocket into a sorted trade array"""
+        return to_trades(**self.parse_trade_columns(pull))
+
+    def _update_cache_stats(self, markets=None):
+        """records the last measure from the cache (for all markets, or just the ones given)"""
+        for market in list(self.cache.keys()) if markets is None else markets:
+            txs = self.cache[market]["txs"]
+            if len(txs) > 0:
                 for measure in ["time", "id", "price"]:
-                    self.cache[market]["last_" + measure] = self.cache[market]["txs"][
-                        measure
-                    ].iloc[-1]
+                    self.cache[market]["last_" + measure] = txs[measure][-1].item()
 
-    def _update_cache(self):
+    def _update_cache(self, markets=None, timeout=None):
 
         """
-        This pulls recent tick for the desired markets and calculates a few stats about them
+        This pulls recent tick for the desired markets (all, or just the ones given) and calculates
+        a few stats about them. timeout is how long to wait on the fetches (half an interval by
+        default).
+        Returns the markets whose fetch didn't land - it failed, their breaker is open or they
+        didn't answer in time. They count nothing and keep their cursor for next time.
         WARNING:
             - It does NOT update last price etc. That should be done after the counting step
         """
 
-        now = round(datetime.now().timestamp() * 1000)
-
-        pulls = {}
-        for market in list(self.cache.keys()):
-            pulls[market] = self._pull_txs(market, now)
-
-        # these are in separate loops to decrease the time it takes to get data from all
-        # the desired markets. The above loop should be quick as possible!
-        for market in list(self.cache.keys()):
-
-            self.cache[market]["txs"] = (
-                pulls[market]
-                .loc[pulls[market]["time"] >= self.cache[market]["last_time"]]
-                .loc[pulls[market]["id"] > self.cache[market]["last_id"]]
-                .copy()
-            )
-
-            self.cache[market]["txs"]["cum_tick"] = [
-                x + 1 for x in range(len(self.cache[market]["txs"]))
-            ]
-            self.cache[market]["txs"]["cum_volume"] = self.cache[market]["txs"]["size"].cumsum()
-            self.cache[market]["txs"]["cum_dollar"] = self.cache[market]["txs"]["dollar"].cumsum()
+        markets = list(self.cache) if markets is None else markets
 
-    def _update_counts(self):
+        # markets whose first pull failed still need a starting price
+        unpriced = [market for market in markets if self.cache[market].get("last_price") is None]
+        if len(unpriced) > 0:
+            self._bootstrap(unpriced)
 
-        """updates the counts with info from the reccent txs"""
+        now = round(datetime.now().timestamp() * 1000)
 
-        self.counter["info"] = self.counter[["market", "agg_type", "agg_unit"]].to_dict("records")
-        self.counter["count"] = self.counter["count"] + self.counter["info"].map(
-            self._increment_count
+        markets = [market for market in markets if market not in unpriced]
+        pulls = fetch_all(
+            self.pool,
+            self._pull_market,
+            markets,
+            now,
+            timeout=self.interval / 2 if timeout is None else timeout,
+            pending=self.pending["live"],
         )
 
-        self.counter["recent_index"] = self.counter["info"].map(self._index_quants)
-        self.counter["info"] = self.counter.to_dict("records")
+        # these are in separate loops to decrease the time it takes to get data from all
+        # the desired markets. The fetch above runs every market at once and should be quick!
+        missed = set()
+        for market in markets:
+            trades = pulls.get(market)
+            if trades is None:
+                missed.add(market)
+                trades = np.zeros(0, dtype=TRADE_DTYPE)
+            self._ingest(market, trades)
+        return missed
+
+    def _ingest(self, market, trades):
+        """
+        keeps the txs past the market's cursor as this cycle's new txs and works out their
+        cumulative measures. The trades are sorted by time, so the cursor is a slice (a view) and
+        the ids are only masked when a re-fetched one is in it
+        """
 
-        self.counter = pd.DataFrame([self._trickle(record) for record in self.counter["info"]])
+        entry = self.cache[market]
+        if entry["last_time"] is not None:
+            trades = trades[np.searchsorted(trades["time"], entry["last_time"]) :]
+            fresh = trades["id"] > entry["last_id"]
+            if not fresh.all():
+                trades = trades[fresh]
 
-    def _increment_count(self, record):
+        entry["txs"] = trades
+        entry["ingested"] = time.time_ns()
+        self.metrics.trades.inc(len(trades), market)
+        entry["cum"] = {agg_type: cumulative(entry["txs"], agg_type) for agg_type in AGG_TYPES}
 
-        """increments the cumulative amounts"""
+    def _update_counts(self, markets=None):
 
-        if len(self.cache[record["market"]]["txs"]) > 0:
-            return (
-                self.cache[record["market"]]["txs"]["cum_" + record["agg_type"]].iloc[-1]
-                / record["agg_unit"]
-            )
-        else:
-            return 0.0
-
-    def _index_quants(self, record):
-        """returns an index of prices vs where they are in the recent aggregation"""
-        subj = self.cache[record["market"]]["txs"][["cum_" + record["agg_type"], "price"]]
-        return {x["cum_" + record["agg_type"]]: x["price"] for x in subj.to_dict("records")}
-
-    def _trickle(self, record):
         """
-        this function 'trickles' counts into cusum counts then decides if the cusum limit was hit, updating the record
+        updates the counts in place with info from the recent txs (of all or the given markets)
+        and stamps each hit with the exchange time of the bar close that set it off
         """
-        record["hit"] = False
-        if len(record["recent_index"]) > 0:
-
-            multiples = int(
-                round(record["count"] // 1)
-            )  # this is the number of aggregation points we need to make
 
-            if multiples > 0:
-                rem = round(record["count"] - multiples, 7)
-                pos = [
-                    max(record["recent_index"].keys()) - (rem + x) * record["agg_unit"]
-                    for x in range(multiples)
-                ]
-                idxs = []
-                for idx in pos:
-                    try:
-                        idxs.append(
-                            max([x for x in list(record["recent_index"].keys()) if x <= idx])
-                        )
-                    except ValueError as e:
-                        print("ERROR ESCAPED!")
-                        idxs.append(False)
-
-                for idx in sorted(idxs):
-                    if idx:
-                        record["cusum_count"] += (
-                            abs(record["recent_index"][idx] / record["last_agg_price"] - 1) * 100
-                        )
-                        record["last_agg_price"] = record["recent_index"][idx]
-                    else:
-                        record["cusum_count"] += (
-                            abs(
-                                self.cache[record["market"]]["last_price"]
-                                / record["last_agg_price"]
-                                - 1
-                            )
-                            * 100
-                        )
-                        record["last_agg_price"] = self.cache[record["market"]]["last_price"]
-
-                record["count"] = rem
-
-            if record["cusum_count"] > record["agg_perc"]:
-                record["hit"] = True
-                record["cusum_count"] = record["cusum_count"] - record["agg_perc"] * (
-                    record["cusum_count"] // record["agg_perc"]
-                )
+        counter = self.counter
+        counter.hit[:] = False
+        for (market, agg_type), rows in counter.groups().items():
+            if markets is not None and market not in markets:
+                continue
+            if self.cache[market].get("last_price") is None:
+                continue  # not bootstrapped yet - nothing to count its trades from
+            (
+                counter.count[rows],
+                counter.cusum_count[rows],
+                counter.last_agg_price[rows],
+                counter.hit[rows],
+                trigger,
+            ) = trickle(
+                self.cache[market]["cum"][agg_type],
+                self.cache[market]["txs"]["price"],
+                counter.count[rows],
+                counter.cusum_count[rows],
+                counter.last_agg_price[rows],
+                counter.agg_unit[rows],
+                counter.agg_perc[rows],
+                self.cache[market].get("last_price"),
+            )
+            counter.hit_time[rows] = self._trigger_times(market, trigger)
+            self.cache[market]["computed"] = time.time_ns()
+            self.metrics.counters_evaluated.inc(len(rows))
+        self.metrics.hits.inc(int(counter.hit.sum()))
 
-        return record
+    def _trigger_times(self, market, trigger):
+        """
+        the exchange times of the trades at the given batch indices. -1 means the bar closed on
+        the previous batch's last trade (or there was no hit)
+        """
+        txs = self.cache[market]["txs"]
+        before = self.cache[market].get("last_time") or 0
+        if len(txs) == 0:
+            return np.full(len(trigger), before, dtype=np.int64)
+        return np.where(trigger >= 0, txs["time"][np.maximum(trigger, 0)], before)
+
+    def _hits(self):
+        """the counters that hit this cycle and the chat ids to tell"""
+        return self.counter.to_frame(self.counter.hit)[
+            ["ids", "market", "agg_type", "agg_unit", "agg_perc", "last_agg_price", "hit_time"]
+        ]
 
     def _send_pings(self):
 
@@ -316,19 +455,21 @@ class CUSUM(ftx):
         a 'registry' dict.
         """
 
-        active = self.counter[self.counter["hit"] == True][
-            ["ids", "market", "agg_type", "agg_unit", "agg_perc", "last_agg_price"]
-        ]
-
-        if len(active) > 0:
-            with open("logfile.txt", "a+") as f:
-                f.write(datetime.strftime(datetime.now(), "%Y-%m-%d %H:%M:%S.%f") + "\n")
-                f.write(active.to_string() + "\n\n")
+        active = self._hits()
 
-        registry = reg_keys(active["ids"].to_list())
+        self.levels.refresh()
+        ranges = [
+            self.levels.active_range(market, price)
+            for market, price in zip(active["market"], active["last_agg_price"])
+        ]
+        active["range"] = [format_range(x) for x in ranges]
 
-        active["get_range"] = active[["market", "last_agg_price"]].to_dict("records")
-        active["range"] = active["get_range"].map(lambda x: get_active_range(**x))
+        if self.hitlog is not None and len(active) > 0:
+            records = active.drop(columns="range").to_dict("records")
+            for record, (low, high) in zip(records, ranges):
+                record["low"], record["high"] = low, high
+                record["ids"] = list(record["ids"])  # the store's lists change under the writer
+            self.hitlog.write(records)
 
         active["msg"] = (
             active["market"]
@@ -341,14 +482,75 @@ class CUSUM(ftx):
             + "% filter hit\n@ $"
             + active["last_agg_price"].astype(str)
             + "\n\nActive range:\n"
-            + active["range"].astype(str)
+            + active["range"]
         )
+        if self.show_delay and len(active) > 0:
+            delay = (time.time_ns() - active["hit_time"]) / 1e9
+            active["msg"] = active["msg"] + "\n\nDelay: " + delay.round(1).astype(str) + "s"
+
+        # one outbox entry per hit per chat, keyed on the watch and the bar that set it off. The
+        # timestamps are kept so the hits can be timed once they're delivered
+        entries, watches, rows = [], {}, {}
+        for row in active[
+            ["ids", "msg", "market", "agg_type", "agg_unit", "agg_perc", "hit_time"]
+        ].to_dict("records"):
+            entry = self.cache[row["market"]]
+            if row["hit_time"] != 0 and "computed" in entry:
+                row["ingested"], row["computed"] = entry["ingested"], entry["computed"]
+            for id in [x for x in row["ids"] if x != -1]:
+                watch = "{}:{market}:{agg_type}:{agg_unit}:{agg_perc}".format(id, **row)
+                key = "{}:{}".format(watch, row["hit_time"])
+                entries.append((key, id, row["msg"]))
+                watches[key] = watch
+                rows[key] = row
+
+        # duplicates are dropped by the outbox and never sent, so only the new hits are traced
+        if self.outbox is not None:
+            new = self.outbox.put(entries)
+            entries = self.outbox.due() + new
+        else:
+            new = entries
+        for key, _, _ in new:
+            self.traces[key] = rows[key]
+        self.digest.add(entries, watches)
+        self._deliver(self.digest.ready())
 
-        for row in active[["ids", "msg"]].to_dict("records"):
-            for id in row["ids"]:
-                registry[id] = registry[id] + "\n\n" + row["msg"]
-
-        send_notif(registry)
+    def _deliver(self, messages):
+        """
+        sends (keys, chat id, text) messages and acks their keys in the outbox once delivered (or
+        marks them failed, to be sent again)
+        """
+        for keys, id, text in messages:
+
+            def done(id, delivered, keys=keys):
+                if self.outbox is not None:
+                    (self.outbox.ack if delivered else self.outbox.fail)(keys)
+                rows = [self.traces.pop(key) for key in keys if key in self.traces]
+                if delivered:
+                    self._trace_latency(rows)
+
+            send_notif({id: text}, self.dispatcher, on_done=done)
+
+    def _resend_outbox(self):
+        """sends whatever the last run left undelivered, before anything new"""
+        if self.outbox is not None and len(self.outbox) > 0:
+            cprint("yellow", "resending {} undelivered notifications".format(len(self.outbox)))
+            self.digest.add(self.outbox.pending())
+            self._deliver(self.digest.ready(flush=True))
+
+    def _trace_latency(self, rows):
+        """times delivered hits from their bar close on the exchange through to the send"""
+        sent = time.time_ns()
+        for row in rows:
+            if "computed" not in row:
+                continue
+            stages = self.latency.record(row["hit_time"], row["ingested"], row["computed"], sent)
+            if self.latency.is_slow(stages):
+                cprint(
+                    "red",
+                    "slow alert: {market} {agg_unit} {agg_type} {agg_perc}% -".format(**row),
+                    ", ".join("{} {:.2f}s".format(stage, x) for stage, x in stages.items()),
+                )
 
     def _log_output(self):
         """
@@ -370,8 +572,15 @@ class CUSUM(ftx):
                         "tick": len(self.cache[market_name]["txs"]),
                         "dollar": self.cache[market_name]["txs"]["dollar"].sum(),
                         "volume": self.cache[market_name]["txs"]["size"].sum(),
-                        "last_time": self.cache[market_name]["last_time"],
+                        "last_time": pd.to_datetime(self.cache[market_name]["last_time"]),
                         "last_id": self.cache[market_name]["last_id"],
+                        "pages": self.cache[market_name].get("fetch", {}).get("pages"),
+                        "gap": self.cache[market_name].get("fetch", {}).get("gap"),
+                        "breaker": (
+                            self.breakers[market_name].state
+                            if market_name in self.breakers
+                            else None
+                        ),
                     }
                     for market_name in self.cache
                 )
@@ -380,7 +589,7 @@ class CUSUM(ftx):
         cprint("green", "\nCounters:")
         cprint(
             "green",
-            self.counter[
+            self.counter.to_frame()[
                 [
                     "market",
                     "agg_type",
@@ -393,30 +602,36 @@ class CUSUM(ftx):
                 ]
             ],
         )
-
-    def _fill_price(self, last_agg_price, market):
-        """
-        Grabs the the last cached price and stores it as the last_agg_price
-        The last agg price can't be zero or the perc diff will always be 100!
-        """
-
-        if last_agg_price == 0.0:
-            return self.cache[market]["last_price"]
-        else:
-            return last_agg_price
+        latency = self.latency.percentiles()
+        if latency:
+            cprint("yellow", "\nAlert latency (s):")
+            cprint("yellow", pd.DataFrame(latency).T)
 
     def _main_loop(self):
         """
         The loop that will be run every interval
         """
         failed = False
+        began = time.perf_counter()
         try:
-            self._update_cache()
-            self._update_counts()
-            self._send_pings()
-            self._update_cache_stats()
-            self._log_output()
-            self._update_mongo_watchlist()
+            with self.metrics.phase("update_cache"):
+                self._update_cache()
+            with self.metrics.phase("update_counts"):
+                self._update_counts()
+            with self.metrics.phase("send_pings"):
+                self._send_pings()
+            with self.metrics.phase("update_cache_stats"):
+                self._update_cache_stats()
+            with self.metrics.phase("log_output"):
+                self._log_output()
+            with self.metrics.phase("update_mongo_watchlist"):
+                self._update_mongo_watchlist()
+            self.reporter.flush()
+
+            self.cycles += 1
+            if self.cycles % self.checkpoint_every == 0:
+                with self.metrics.phase("checkpoint"):
+                    self._checkpoint()
 
             if failed:
                 send_live_report()
@@ -424,18 +639,142 @@ class CUSUM(ftx):
 
         except Exception as e:
             failed = True
-            send_crash_report(e)
+            self.reporter.report(e)
+
+        elapsed = time.perf_counter() - began
+        self.metrics.cycle_seconds.observe(elapsed)
+        if elapsed > self.interval:
+            self.metrics.overruns.inc()
+
+    def stop(self):
+        """
+        asks the loop to shut down once the cycle (or stream batch) it's on is finished. Safe to
+        call from a signal handler
+        """
+        self.stopped.set()
+        if getattr(self, "stream", None) is not None:
+            self.stream.trades.put((None, None))  # wakes a stream loop waiting on batches
 
     def run(self):
         """
-        kicks off the whole process
+        kicks off the whole process. It runs until stop() is called, then checkpoints and returns.
+        The checkpoint is only taken between cycles, where the counters and cursors agree - if the
+        loop is torn down mid-cycle (an exception) the last periodic checkpoint stands
         """
 
-        # at the start, we update the cache as we need only uncached transactions later from which to aggregate
-        self._update_cache()
-        self._update_cache_stats()
-        time.sleep(self.interval)
+        try:
+            self._resend_outbox()
+            if self.restored:
+                # replay everything since the checkpoint's cursors
+                self._main_loop()
+            else:
+                # at the start, we update the cache as we need only uncached transactions later from which to aggregate
+                self._update_cache()
+                self._update_cache_stats()
+            self.stopped.wait(self.interval)
+
+            while not self.stopped.is_set():
+                if self.stopped.wait(self.interval - time.time() % self.interval):
+                    break
+                self._main_loop()
+            self._checkpoint()
+        finally:
+            self._deliver(self.digest.ready(flush=True))
+            self.dispatcher.close(timeout=10)
+            if self.hitlog is not None:
+                self.hitlog.close(timeout=10)
+
+    def run_stream(self, url=FTX_WS):
+        """
+        kicks off the streaming process: trades are counted batch by batch as they arrive on the
+        websocket. On every (re)connect the REST path fills in whatever was missed. The watchlist
+        sync and log output still run once per interval. Stops (and checkpoints) as run does.
+        """
+
+        self.stream = TradeStream(list(self.cache), url=url)
+        self.stream.start()
+        next_sync = time.time() + self.interval
+
+        try:
+            self._resend_outbox()
+            self._stream_loop(next_sync)
+            self._checkpoint()
+        finally:
+            self.stream.stop()
+            self._deliver(self.digest.ready(flush=True))
+            self.dispatcher.close(timeout=10)
+            if self.hitlog is not None:
+                self.hitlog.close(timeout=10)
+
+    def _stream_loop(self, next_sync):
+        """
+        the body of run_stream: counts batches as they land and syncs once per interval
 
-        while 1:
-            time.sleep(self.interval - time.time() % self.interval)
-            self._main_loop()
+        After a (re)connect every market's gap is filled over REST before any of its later trades
+        are counted. A market whose fill doesn't land (a failed or slow fetch) holds its stream
+        trades back and has its fill tried again every pass - without waiting on it - until it
+        does, so its cursor never jumps the gap
+        """
+        unfilled, held = set(), {}
+        while not self.stopped.is_set():
+            try:
+                if self.stream.reconnected.is_set():
+                    self.stream.reconnected.clear()
+                    unfilled, timeout = set(self.cache), None
+                else:
+                    timeout = 0  # a retry only collects what has come back since
+                unfilled &= set(self.cache)
+                if len(unfilled) > 0:
+                    filling = [market for market in self.cache if market in unfilled]
+                    with self.metrics.phase("update_cache"):
+                        unfilled = self._update_cache(filling, timeout=timeout)
+                    self._count_batch([market for market in filling if market not in unfilled])
+
+                wait = max(next_sync - time.time(), 0)
+                if any(market not in unfilled for market in held):
+                    wait = 0  # held trades whose gap just landed go now
+                elif len(unfilled) > 0:
+                    wait = min(wait, 1)
+                batch = self.stream.batches(timeout=wait)
+                for market in [market for market in batch if market in unfilled]:
+                    held.setdefault(market, []).extend(batch.pop(market))
+                for market in [market for market in held if market not in unfilled]:
+                    batch[market] = held.pop(market) + batch.get(market, [])
+                markets = [market for market in batch if market in self.cache]
+                # as in _update_cache, markets without a starting price are bootstrapped
+                # rather than counted
+                unpriced = [m for m in markets if self.cache[m].get("last_price") is None]
+                if len(unpriced) > 0:
+                    self._bootstrap(unpriced)
+                    markets = [market for market in markets if market not in unpriced]
+                with self.metrics.phase("ingest"):
+                    for market in markets:
+                        self._ingest(market, self._parse_txs(batch[market]))
+                self._count_batch(markets)
+
+                if time.time() >= next_sync:
+                    next_sync = time.time() + self.interval
+                    with self.metrics.phase("log_output"):
+                        self._log_output()
+                    with self.metrics.phase("update_mongo_watchlist"):
+                        self._update_mongo_watchlist()
+                    self.stream.resubscribe(self.cache)
+                    self.reporter.flush()
+
+                    self.cycles += 1
+                    if self.cycles % self.checkpoint_every == 0:
+                        with self.metrics.phase("checkpoint"):
+                            self._checkpoint()
+
+            except Exception as e:
+                self.reporter.report(e)
+
+    def _count_batch(self, markets):
+        """counts what was just ingested for the given markets, pings and moves their cursors"""
+        if len(markets) > 0:
+            with self.metrics.phase("update_counts"):
+                self._update_counts(markets)
+            with self.metrics.phase("send_pings"):
+                self._send_pings()
+            with self.metrics.phase("update_cache_stats"):
+                self._update_cache_stats(markets)
@@ -0,0 +1,88 @@
+"""
+The vectorised CUSUM engine.
+
+Takes the cumulative tick/volume/dollar arrays of a market's new transactions and moves every
+counter watching that market/measure forward in one batched pass.
+
+Counters that share a bar series (same agg_unit, count and last_agg_price - e.g. one watch at
+several agg_percs) only have their bar closes formed once (see bars.py). Each threshold then
+applies its own filter to the shared closes.
+
+"""
+
+import numpy as np
+
+from .bars import bar_closes
+
+
+def apply_filter(cusum_count, agg_perc, moves, starts, lens):
+    """
+    adds each counter's bar moves to its cusum count and checks it against its agg_perc
+    starts/lens give each counter's run of moves (see bars.bar_closes)
+    returns (cusum_count, hit, trigger) - trigger is the index of the move that took each counter
+    over its agg_perc (-1 if it didn't cross in this batch)
+    """
+
+    cusum_count = np.array(cusum_count, dtype=np.float64)
+    agg_perc = np.asarray(agg_perc, dtype=np.float64)
+    trigger = np.full(len(cusum_count), -1, dtype=np.int64)
+
+    # accumulate step by step so the float sums come out exactly as a sequential +=
+    for step in range(lens.max() if len(lens) > 0 else 0):
+        sel = lens > step
+        cusum_count[sel] += moves[starts[sel] + step]
+        crossed = sel & (trigger < 0) & (cusum_count > agg_perc)
+        trigger[crossed] = starts[crossed] + step
+
+    hit = cusum_count > agg_perc
+    cusum_count[hit] = cusum_count[hit] - agg_perc[hit] * (cusum_count[hit] // agg_perc[hit])
+
+    return cusum_count, hit, trigger
+
+
+def trickle(cum, price, count, cusum_count, last_agg_price, agg_unit, agg_perc, last_price):
+    """
+    'trickles' counts into cusum counts for a batch of counters sharing one market and agg_type
+
+    takes:
+        cum, price, last_price - as for bars.bar_closes
+        count, cusum_count, last_agg_price, agg_unit, agg_perc - counter state, one entry per counter
+
+    returns:
+        (count, cusum_count, last_agg_price, hit, trigger) as new arrays - trigger is the index in
+        the batch of the trade whose bar close set off each hit (-1 if there was no hit or the bar
+        closed on last_price)
+
+    A non-empty batch can't be counted without the market's last_price (ValueError).
+    """
+
+    agg_unit = np.asarray(agg_unit, dtype=np.float64)
+    count = np.asarray(count, dtype=np.float64)
+    last_agg_price = np.asarray(last_agg_price, dtype=np.float64)
+
+    if len(cum) == 0:
+        return (
+            count.copy(),
+            np.array(cusum_count, dtype=np.float64),
+            last_agg_price.copy(),
+            np.zeros(len(agg_unit), dtype=bool),
+            np.full(len(agg_unit), -1, dtype=np.int64),
+        )
+
+    if last_price is None:
+        raise ValueError("a batch can't be counted before the market has a last_price")
+
+    # one bar series per distinct (agg_unit, count, last_agg_price)
+    series, inverse = np.unique(
+        np.stack([agg_unit, count, last_agg_price], axis=1), axis=0, return_inverse=True
+    )
+    inverse = inverse.reshape(-1)
+
+    bars = bar_closes(cum, price, series[:, 1], series[:, 2], series[:, 0], last_price)
+    cusum_count, hit, trigger = apply_filter(
+        cusum_count, agg_perc, bars.move, bars.starts[inverse], bars.lens[inverse]
+    )
+    if len(bars.index) > 0:
+        trigger = np.where(trigger >= 0, bars.index[np.maximum(trigger, 0)], -1)
+
+    return bars.count[inverse], cusum_count, bars.last_agg_price[inverse], hit, trigger
@@ -0,0 +1,193 @@
+"""
+A structured log of every hit.
+
+Each hit is one json line (the watch, the price, the bar close time, the active range and who was
+told). The loop only puts the records on a queue - a background thread does the writing, so
+however much is logged it costs the loop nothing.
+
+The live file is rotated once it gets too big or too old. Rotated files are named after the time
+they were started (hits.20221018T120000000000.jsonl), so they sort oldest first and a read over a
+time range can skip the files outside it. read_hits loads the lot (or a range) back as a DataFrame.
+
+fsync is one of
+    "never" - leave it to the OS
+    "rotate" - when a file is rotated or the log is closed
+    "always" - after every batch
+
+"""
+
+import glob
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+FIELDS = [
+    "logged",
+    "market",
+    "agg_type",
+    "agg_unit",
+    "agg_perc",
+    "last_agg_price",
+    "hit_time",
+    "low",
+    "high",
+    "ids",
+]
+
+STAMP = "%Y%m%dT%H%M%S%f"
+
+
+def log_files(path="hits.jsonl"):
+    """the log's files, oldest first - the rotated ones and then the live one"""
+    base, ext = os.path.splitext(path)
+    rotated = sorted(glob.glob(glob.escape(base) + ".*" + glob.escape(ext)))
+    return rotated + ([path] if os.path.exists(path) else [])
+
+
+def read_hits(path="hits.jsonl", since=None, until=None):
+    """
+    the logged hits as a DataFrame, oldest first
+    since, until - only the hits logged in this range (anything pd.Timestamp takes, or epoch ns)
+    A torn line at the end of a file (a crash mid-write) is skipped
+    """
+    since = None if since is None else _ns(since)
+    until = None if until is None else _ns(until)
+
+    files = log_files(path)
+    starts = [_started(name, path) for name in files]
+    records = []
+    for i, name in enumerate(files):
+        # a file holds what was logged from its start up to the next file's start
+        if until is not None and starts[i] is not None and starts[i] > until:
+            continue
+        if since is not None and i + 1 < len(files) and starts[i + 1] is not None:
+            if starts[i + 1] <= since:
+                continue
+        with open(name) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+    hits = pd.DataFrame.from_records(records, columns=FIELDS)
+    if since is not None:
+        hits = hits[hits["logged"] >= since]
+    if until is not None:
+        hits = hits[hits["logged"] <= until]
+    return hits.reset_index(drop=True)
+
+
+def _ns(when):
+    return when if isinstance(when, int) else pd.Timestamp(when).value
+
+
+def _started(name, path):
+    """when a rotated file was started, from its name (None for the live file)"""
+    if name == path:
+        return None
+    base, ext = os.path.splitext(path)
+    return pd.Timestamp(datetime.strptime(name[len(base) + 1 : len(name) - len(ext)], STAMP)).value
+
+
+class HitLog:
+    def __init__(
+        self, path="hits.jsonl", max_bytes=64 * 2**20, max_age=86400, fsync="rotate", keep=None
+    ):
+        """
+        path - the live log file
+        max_bytes, max_age - the size (bytes) and age (seconds) the live file is rotated at
+        fsync - "never", "rotate" or "always" (see above)
+        keep - how many rotated files to keep (None for all of them)
+        """
+        if fsync not in ["never", "rotate", "always"]:
+            raise ValueError("fsync must be never, rotate or always, not {}".format(fsync))
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync = fsync
+        self.keep = keep
+        self.queue = queue.Queue()
+        self._open()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def write(self, records):
+        """queues hit records (dicts of the FIELDS, less logged) and returns straight away"""
+        if len(records) > 0:
+            self.queue.put((time.time_ns(), records))
+
+    def close(self, timeout=None):
+        """writes out whatever is queued and closes the file"""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _work(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = [
+                json.dumps(dict(record, logged=logged))
+                for logged, records in [x for x in batch if x is not None]
+                for record in records
+            ]
+            if len(lines) > 0:
+                try:
+                    if self.file.tell() > 0 and (
+                        self.file.tell() >= self.max_bytes
+                        or time.time() - self.started >= self.max_age
+                    ):
+                        self._rotate()
+                    self.file.write("\n".join(lines) + "\n")
+                    self.file.flush()
+                    if self.fsync == "always":
+                        os.fsync(self.file.fileno())
+                except OSError as e:
+                    print("hit log write failed: {}".format(e))
+
+            if None in batch:
+                if self.fsync != "never":
+                    os.fsync(self.file.fileno())
+                self.file.close()
+                return
+
+    def _open(self):
+        """opens the live file, taking its start time from its first record if it has one"""
+        self.started = time.time()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                try:
+                    self.started = json.loads(f.readline())["logged"] / 1e9
+                except (ValueError, KeyError):
+                    pass
+        self.file = open(self.path, "a")
+        # finish off a line torn by a crash, so the next record doesn't run on from it
+        if self.file.tell() > 0:
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self.file.write("\n")
+
+    def _rotate(self):
+        """moves the live file aside under its start time and starts a new one"""
+        if self.fsync != "never":
+            os.fsync(self.file.fileno())
+        self.file.close()
+        base, ext = os.path.splitext(self.path)
+        stamp = pd.Timestamp(self.started, unit="s").strftime(STAMP)
+        os.replace(self.path, "{}.{}{}".format(base, stamp, ext))
+        if self.keep is not None:
+            for name in log_files(self.path)[: -self.keep or None]:
+                os.remove(name)
+        self.file = open(self.path, "a")
+        self.started = time.time()
@@ -0,0 +1,43 @@
+"""
+Concurrent ingestion for the watcher.
+
+Every market is fetched at once on a bounded thread pool. All requests share one token bucket
+(common/ratelimit.py) sized from the exchange's rateLimit, so going wide doesn't break the
+exchange's budget.
+
+The cycle only waits so long for its fetches. A market that hangs is left out of the cycle (its
+cursor stays put) while the rest are counted, and it isn't fetched again until the hung request
+returns - whatever that brings back is handed over on the next cycle instead.
+
+"""
+
+from concurrent.futures import wait
+
+
+def fetch_all(pool, fn, markets, *args, timeout=None, pending=None, **kwargs):
+    """
+    runs fn(market, *args, **kwargs) for every market on the pool and returns {market: result}
+
+    timeout - the most seconds to wait for them (None waits for all). Markets that haven't
+              finished by then are left out of the result
+    pending - {market: future} of fetches still running from earlier calls. A market with one is
+              not fetched again: its result is used once it's done. Unfinished fetches are left in
+              it for the next call
+    """
+    pending = {} if pending is None else pending
+    futures = {}
+    for market in markets:
+        future = pending.pop(market, None)
+        futures[market] = future if future is not None else pool.submit(fn, market, *args, **kwargs)
+    # finished leftovers of markets that are no longer asked for aren't worth keeping
+    for market in [market for market, future in pending.items() if future.done()]:
+        del pending[market]
+
+    done, _ = wait(futures.values(), timeout=timeout)
+    results = {}
+    for market, future in futures.items():
+        if future in done:
+            results[market] = future.result()
+        else:
+            pending[market] = future
+    return results
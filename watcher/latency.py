@@ -0,0 +1,61 @@
+"""
+Trade-to-notification latency.
+
+Every hit carries the exchange time of the bar close that set it off, when its trades were
+ingested, when it was counted and when its notification went out. The tracker keeps a window of
+recent alerts for percentiles and feeds each stage into the metrics. Exchange times are ftx's clock
+and the rest are ours, so any skew between the two lands in the ingest stage.
+
+"""
+
+import threading
+from collections import deque
+
+import numpy as np
+
+STAGES = ["ingest", "compute", "send", "total"]
+
+
+class LatencyTracker:
+    def __init__(self, window=1000, slow=30, metrics=None):
+        """
+        window - how many recent alerts the percentiles are taken over
+        slow - seconds from bar close to send past which an alert counts as slow (None for never)
+        metrics - a Metrics to observe the stages into
+        """
+        self.samples = {stage: deque(maxlen=window) for stage in STAGES}
+        self.slow = slow
+        self.metrics = metrics
+        self.lock = threading.Lock()
+
+    def record(self, exchange, ingested, computed, sent):
+        """records one alert's timestamps (epoch ns) and returns its stage latencies in seconds"""
+        stages = {
+            "ingest": (ingested - exchange) / 1e9,
+            "compute": (computed - ingested) / 1e9,
+            "send": (sent - computed) / 1e9,
+            "total": (sent - exchange) / 1e9,
+        }
+        with self.lock:
+            for stage, seconds in stages.items():
+                self.samples[stage].append(seconds)
+        for stage, seconds in stages.items():
+            if self.metrics is not None:
+                self.metrics.alert_latency.observe(seconds, stage)
+        return stages
+
+    def is_slow(self, stages):
+        return self.slow is not None and stages["total"] > self.slow
+
+    def percentiles(self, q=(50, 95, 99)):
+        """{stage: {"p50": seconds, ...}} over the window (empty before the first alert)"""
+        with self.lock:
+            samples = {stage: np.array(self.samples[stage]) for stage in STAGES}
+        if len(samples["total"]) == 0:
+            return {}
+        return {
+            stage: {
+                "p{}".format(x): value for x, value in zip(q, np.percentile(values, q).tolist())
+            }
+            for stage, values in samples.items()
+        }
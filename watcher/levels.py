@@ -0,0 +1,65 @@
+"""
+An in-memory index of the support/resistance levels.
+
+Every asset's levels (archive.keyPriceLevels) are loaded once and kept sorted, so finding the
+active range around a price is a bisect rather than a mongo round trip per hit. The collection is
+followed with the same change-driven sync (sync.py) as the watchlists, polled on a clock rather than
+when there are hits. With a change stream edits are picked up on the next poll. The level documents
+carry no updatedAt, so without one they're only seen by the full read every resync_every polls.
+
+"""
+
+import time
+from bisect import bisect_left
+
+from .sync import CollectionSync
+
+
+def format_range(active_range):
+    """(low, high) as shown in a notification - a side beyond every known level shows as -"""
+    return "({}, {})".format(*["-" if x is None else x for x in active_range])
+
+
+class LevelIndex:
+    def __init__(self, collection, every=60, resync_every=10):
+        """
+        collection - the keyPriceLevels collection ({name, levels} documents)
+        every - the least seconds between polls of the collection
+        resync_every - how many polls between full reads of the collection
+        """
+        self.sync = CollectionSync(collection, resync_every=resync_every)
+        self.every = every
+        self.due = 0  # time.monotonic() of the next poll
+        self.levels = {}
+        self.loaded = False
+
+    def refresh(self):
+        """
+        loads the levels the first time and picks up any changed assets after that. Cheap to call
+        every cycle - the collection is polled at most once per every seconds
+        """
+        if time.monotonic() < self.due:
+            return
+        self.due = time.monotonic() + self.every
+        if not self.loaded:
+            changes = {key: (None, doc) for key, doc in self.sync.load().items()}
+            self.loaded = True
+        else:
+            changes = self.sync.poll()
+        for old, new in changes.values():
+            if old is not None:
+                self.levels.pop(old["name"], None)
+            if new is not None:
+                self.levels[new["name"]] = sorted(float(x) for x in new["levels"])
+
+    def active_range(self, market, price):
+        """
+        the nearest levels either side of a price: (highest below it, lowest at or above it)
+        A side is None when the price is beyond every level (or the asset has none)
+        """
+        levels = self.levels.get(market.split("/")[0], [])
+        i = bisect_left(levels, price)
+        return (
+            levels[i - 1] if i > 0 else None,
+            levels[i] if i < len(levels) else None,
+        )
@@ -0,0 +1,176 @@
+"""
+Instrumentation for the watcher.
+
+A small in-process registry of counters and histograms, and a local http endpoint serving them in
+the Prometheus text format (GET /metrics). It only needs what the watcher records, so there's no
+client library to install.
+
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60, 120, 300)
+
+
+def _labels(pairs):
+    """renders [(key, value)] as {key="value",...} (empty when there are none)"""
+    pairs = [(key, value) for key, value in pairs if key is not None and value is not None]
+    if len(pairs) == 0:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+            for key, value in pairs
+        )
+        + "}"
+    )
+
+
+class Counter:
+    def __init__(self, name, help, label=None):
+        """a monotonic count, optionally split by one label"""
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, label=None):
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help), "# TYPE {} counter".format(self.name)]
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda x: str(x[0]))
+        for label, value in values or [(None, 0)]:
+            lines.append("{}{} {}".format(self.name, _labels([(self.label, label)]), value))
+        return "\n".join(lines)
+
+
+class Histogram:
+    def __init__(self, name, help, label=None, buckets=SECONDS_BUCKETS):
+        """observations counted into cumulative buckets, optionally split by one label"""
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.values = {}  # label -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, label=None):
+        with self.lock:
+            counts = self.values.setdefault(label, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        with self.lock:
+            values = sorted(
+                ((label, list(counts)) for label, counts in self.values.items()),
+                key=lambda x: str(x[0]),
+            )
+        for label, counts in values:
+            for bound, count in zip(self.buckets + ("+Inf",), counts[:-2] + [counts[-1]]):
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        self.name, _labels([(self.label, label), ("le", bound)]), count
+                    )
+                )
+            lines.append(
+                "{}_sum{} {}".format(self.name, _labels([(self.label, label)]), counts[-2])
+            )
+            lines.append(
+                "{}_count{} {}".format(self.name, _labels([(self.label, label)]), counts[-1])
+            )
+        return "\n".join(lines)
+
+
+class Metrics:
+    def __init__(self):
+        """everything the watcher reports about itself"""
+        self.phase_seconds = Histogram(
+            "zenobot_phase_seconds", "time spent in each phase of the watcher loop", "phase"
+        )
+        self.cycle_seconds = Histogram("zenobot_cycle_seconds", "time taken by a whole cycle")
+        self.trades = Counter("zenobot_trades_ingested_total", "new trades ingested", "market")
+        self.counters_evaluated = Counter(
+            "zenobot_counters_evaluated_total", "cusum counters moved forward by the engine"
+        )
+        self.hits = Counter("zenobot_hits_total", "cusum filter hits emitted")
+        self.overruns = Counter(
+            "zenobot_cycle_overruns_total", "cycles that took longer than the interval"
+        )
+        self.fetch_errors = Counter(
+            "zenobot_fetch_errors_total", "failed trade fetches from the exchange", "market"
+        )
+        self.alert_latency = Histogram(
+            "zenobot_alert_latency_seconds",
+            "trade-to-notification latency of each alert, by stage",
+            "stage",
+            LATENCY_BUCKETS,
+        )
+        self.server = None
+
+    @contextmanager
+    def phase(self, name):
+        """times the block into the phase histogram"""
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds.observe(time.perf_counter() - began, name)
+
+    def render(self):
+        """the whole registry in the Prometheus text format"""
+        return (
+            "\n".join(
+                metric.render()
+                for metric in [
+                    self.phase_seconds,
+                    self.cycle_seconds,
+                    self.trades,
+                    self.counters_evaluated,
+                    self.hits,
+                    self.overruns,
+                    self.fetch_errors,
+                    self.alert_latency,
+                ]
+            )
+            + "\n"
+        )
+
+    def serve(self, port, host="127.0.0.1"):
+        """serves /metrics from a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
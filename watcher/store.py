@@ -0,0 +1,238 @@
+"""
+A compact counter store for the CUSUM watcher.
+
+The counters live in typed numpy columns (struct-of-arrays) that are updated in place every cycle.
+Market and agg_type are stored as integer codes. Only turn the store into a DataFrame for logging
+and debugging - never inside the loop.
+
+Watchlist edits are applied with reconcile, which only touches the counters that changed.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+from .bars import AGG_TYPES
+
+COLUMNS = [
+    "market",
+    "agg_type",
+    "agg_unit",
+    "agg_perc",
+    "count",
+    "cusum_count",
+    "last_agg_price",
+    "hit",
+    "hit_time",
+]
+
+
+def subscriptions(doc):
+    """
+    every watch in a watchList document as (key, username, chat id), where key is
+    (market, agg_type, agg_unit, agg_perc)
+    """
+    subs = set()
+    for entry in doc["watchList"]:
+        for agg in entry["aggs"]:
+            agg_type, agg_unit, agg_perc = agg.split("_")
+            key = (entry["market"], agg_type, float(agg_unit), float(agg_perc))
+            subs.add((key, doc["TGUsername"], doc["TGChatID"]))
+    return subs
+
+
+class CounterStore:
+    def __init__(self, docs=()):
+        """
+        Build the store from watchList documents
+        Missing last_agg_price values are stored as NaN
+        """
+
+        self.markets = []
+        self.market = np.zeros(0, dtype=np.int32)
+        self.agg_type = np.zeros(0, dtype=np.int8)
+        self.agg_unit = np.zeros(0, dtype=np.float64)
+        self.agg_perc = np.zeros(0, dtype=np.float64)
+        self.count = np.zeros(0, dtype=np.float64)
+        self.cusum_count = np.zeros(0, dtype=np.float64)
+        self.last_agg_price = np.zeros(0, dtype=np.float64)
+        self.hit = np.zeros(0, dtype=bool)
+        self.hit_time = np.zeros(0, dtype=np.int64)  # epoch ns of the bar close that hit
+        self.users = []
+        self.ids = []
+        self._index = {}  # key -> row
+        self._series = {}  # (market, agg_type, agg_unit) -> the keys on that bar series
+        self._groups = None
+
+        self.reconcile(subscribe=[sub for doc in docs for sub in subscriptions(doc)])
+
+    def __len__(self):
+        return len(self.agg_unit)
+
+    def key(self, row):
+        """(market, agg_type, agg_unit, agg_perc) of a counter"""
+        return (
+            self.markets[self.market[row]],
+            AGG_TYPES[self.agg_type[row]],
+            self.agg_unit[row].item(),
+            self.agg_perc[row].item(),
+        )
+
+    def groups(self):
+        """returns {(market, agg_type): row indices}, computed once per store layout"""
+        if self._groups is None:
+            key = self.market.astype(np.int64) * len(AGG_TYPES) + self.agg_type
+            order = np.argsort(key, kind="stable")
+            keys, starts = np.unique(key[order], return_index=True)
+            self._groups = {
+                (self.markets[k // len(AGG_TYPES)], AGG_TYPES[k % len(AGG_TYPES)]): rows
+                for k, rows in zip(keys.tolist(), np.split(order, starts[1:]))
+            }
+        return self._groups
+
+    def fill_prices(self, prices):
+        """
+        sets last_agg_price from a {market: price} dict wherever it is missing
+        The last agg price can't be zero or the perc diff will always be 100!
+        """
+        fill = np.array([prices.get(x, np.nan) for x in self.markets], dtype=np.float64)
+        missing = np.isnan(self.last_agg_price) | (self.last_agg_price == 0.0)
+        if len(fill) > 0:
+            self.last_agg_price[missing] = fill[self.market[missing]]
+
+    def reconcile(self, subscribe=(), unsubscribe=(), prices={}):
+        """
+        applies a batch of watchlist changes in place
+        subscribe, unsubscribe - (key, username, chat id) triples (see subscriptions)
+        prices - {market: last price} to seed new counters with
+
+        Counters left without subscribers are dropped. A new key gets a counter, put on the bar
+        series of an existing counter with the same market, agg_type and agg_unit if there is one
+        (so the engine forms those bars once for both), otherwise starting from the market's last
+        price. Every other counter keeps its state.
+        returns the markets (added, removed)
+        """
+
+        # sorted, so the row layout doesn't depend on set order (and replays come out the same)
+        subscribe = sorted(subscribe, key=lambda sub: (sub[0], str(sub[1]), str(sub[2])))
+        new = {}
+        emptied = set()
+        for key, user, chat in unsubscribe:
+            row = self._index.get(key)
+            if row is not None:
+                if user in self.users[row]:
+                    self.users[row].remove(user)
+                if chat in self.ids[row]:
+                    self.ids[row].remove(chat)
+                if len(self.ids[row]) == 0:
+                    emptied.add(key)
+        for key, user, chat in subscribe:
+            row = self._index.get(key)
+            if row is None:
+                users, ids = new.setdefault(key, ([], []))
+            else:
+                users, ids = self.users[row], self.ids[row]
+            if user not in users:
+                users.append(user)
+            if chat not in ids:
+                ids.append(chat)
+
+        before = set(self.markets)
+        for key in sorted(emptied):
+            if key in self._index and len(self.ids[self._index[key]]) == 0:
+                self._drop(self._index[key])
+        if len(new) > 0:
+            self._append(new, prices)
+        if len(emptied) > 0:
+            self._drop_markets()
+        if len(new) > 0 or len(emptied) > 0:
+            self._groups = None
+
+        after = set(self.markets)
+        return after - before, before - after
+
+    def _drop(self, row):
+        """removes a counter by moving the last one into its place"""
+        last = len(self) - 1
+        key = self.key(row)
+        del self._index[key]
+        series = self._series[key[:3]]
+        series.discard(key)
+        if len(series) == 0:
+            del self._series[key[:3]]
+        if row != last:
+            self._index[self.key(last)] = row
+            for name in COLUMNS:
+                getattr(self, name)[row] = getattr(self, name)[last]
+            self.users[row] = self.users[last]
+            self.ids[row] = self.ids[last]
+        for name in COLUMNS:
+            setattr(self, name, getattr(self, name)[:last])
+        self.users.pop()
+        self.ids.pop()
+
+    def _drop_markets(self):
+        """forgets markets nobody watches any more, recoding the rest"""
+        used = np.bincount(self.market, minlength=len(self.markets)) > 0
+        if used.all():
+            return
+        codes = np.cumsum(used) - 1
+        self.market = codes[self.market].astype(np.int32)
+        self.markets = [market for market, keep in zip(self.markets, used.tolist()) if keep]
+
+    def _append(self, new, prices):
+        """adds counters for new keys {key: (users, ids)}"""
+        for market, _, _, _ in new:
+            if market not in self.markets:
+                self.markets.append(market)
+        codes = {market: i for i, market in enumerate(self.markets)}
+
+        keys = list(new)
+        market = np.array([codes[key[0]] for key in keys], dtype=np.int32)
+        agg_type = np.array([AGG_TYPES.index(key[1]) for key in keys], dtype=np.int8)
+        agg_unit = np.array([key[2] for key in keys], dtype=np.float64)
+        count = np.zeros(len(keys), dtype=np.float64)
+        last_agg_price = np.array([prices.get(key[0], np.nan) for key in keys], dtype=np.float64)
+
+        # join an existing bar series where there is one
+        for i, key in enumerate(keys):
+            series = self._series.get(key[:3])
+            if series:
+                row = self._index[next(iter(series))]
+                count[i] = self.count[row]
+                last_agg_price[i] = self.last_agg_price[row]
+
+        start = len(self)
+        self.market = np.concatenate((self.market, market))
+        self.agg_type = np.concatenate((self.agg_type, agg_type))
+        self.agg_unit = np.concatenate((self.agg_unit, agg_unit))
+        self.agg_perc = np.concatenate((self.agg_perc, [key[3] for key in keys]))
+        self.count = np.concatenate((self.count, count))
+        self.cusum_count = np.concatenate((self.cusum_count, np.zeros(len(keys))))
+        self.last_agg_price = np.concatenate((self.last_agg_price, last_agg_price))
+        self.hit = np.concatenate((self.hit, np.zeros(len(keys), dtype=bool)))
+        self.hit_time = np.concatenate((self.hit_time, np.zeros(len(keys), dtype=np.int64)))
+        for i, key in enumerate(keys):
+            self.users.append(new[key][0])
+            self.ids.append(new[key][1])
+            self._index[key] = start + i
+            self._series.setdefault(key[:3], set()).add(key)
+
+    def to_frame(self, rows=None):
+        """the store as a DataFrame (optionally masked by a boolean array) - for logging and debugging"""
+        rows = np.arange(len(self)) if rows is None else np.flatnonzero(np.asarray(rows))
+        return pd.DataFrame(
+            {
+                "market": pd.Series([self.markets[x] for x in self.market[rows]], dtype=object),
+                "users": pd.Series([self.users[x] for x in rows], dtype=object),
+                "agg_perc": self.agg_perc[rows],
+                "agg_type": pd.Series([AGG_TYPES[x] for x in self.agg_type[rows]], dtype=object),
+                "agg_unit": self.agg_unit[rows],
+                "count": self.count[rows],
+                "cusum_count": self.cusum_count[rows],
+                "last_agg_price": self.last_agg_price[rows],
+                "ids": pd.Series([self.ids[x] for x in rows], dtype=object),
+                "hit": self.hit[rows],
+                "hit_time": self.hit_time[rows],
+            }
+        ).set_index(rows)
@@ -0,0 +1,102 @@
+"""
+Streaming trade ingestion.
+
+Subscribes to the ftx websocket trades channel for the watched markets and queues the trades as
+they arrive, so the watcher can count each batch as it lands instead of waiting for the next
+REST poll. The url can be pointed at a local stand-in for testing.
+
+Every (re)connect sets the reconnected flag and wakes whoever is waiting on batches. A batch never
+runs past a reconnect, so the trades after one are only handed out once the watcher has had the
+chance to fill the gap before them over REST (otherwise the cursor would jump the gap).
+
+"""
+
+import json
+import queue
+import threading
+import time
+
+import websocket
+
+FTX_WS = "wss://ftx.com/ws/"
+
+
+class TradeStream:
+    def __init__(self, markets, url=FTX_WS, ping_interval=15):
+        """
+        markets - the markets to subscribe to
+        url - websocket endpoint speaking the ftx protocol
+        ping_interval - seconds between keep-alive pings
+        """
+        self.markets = set(markets)
+        self.url = url
+        self.ping_interval = ping_interval
+        self.trades = queue.Queue()
+        self.reconnected = threading.Event()
+        self.app = None
+        self.running = False
+
+    def start(self):
+        """connects in a background thread, reconnecting until stop() is called"""
+        self.running = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        """disconnects, and wakes anyone waiting on batches"""
+        self.running = False
+        if self.app is not None:
+            self.app.close()
+        self.trades.put((None, None))
+
+    def resubscribe(self, markets):
+        """brings the subscriptions in line with a new set of markets"""
+        markets = set(markets)
+        for market in markets - self.markets:
+            self._send("subscribe", market)
+        for market in self.markets - markets:
+            self._send("unsubscribe", market)
+        self.markets = markets
+
+    def batches(self, timeout):
+        """
+        waits up to timeout seconds for trades, then drains everything queued up to the next
+        reconnect (or stop)
+        returns {market: [trade, ...]} (empty if nothing arrived)
+        """
+        batch = {}
+        try:
+            market, trades = self.trades.get(timeout=timeout)
+        except queue.Empty:
+            return batch
+        while market is not None:
+            batch.setdefault(market, []).extend(trades)
+            try:
+                market, trades = self.trades.get_nowait()
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while self.running:
+            self.app = websocket.WebSocketApp(
+                self.url, on_open=self._on_open, on_message=self._on_message
+            )
+            self.app.run_forever(ping_interval=self.ping_interval)
+            if self.running:
+                time.sleep(1)
+
+    def _send(self, op, market):
+        if self.app is not None and self.app.sock is not None and self.app.sock.connected:
+            self.app.send(json.dumps({"op": op, "channel": "trades", "market": market}))
+
+    def _on_open(self, app):
+        for market in self.markets:
+            self._send("subscribe", market)
+        # anything that traded while we were disconnected needs a REST gap fill
+        self.reconnected.set()
+        self.trades.put((None, None))
+
+    def _on_message(self, app, message):
+        message = json.loads(message)
+        if message.get("channel") == "trades" and message.get("type") == "update":
+            self.trades.put((message["market"], message["data"]))
@@ -0,0 +1,102 @@
+"""
+Change-driven sync of a mongo collection.
+
+Reads a collection once, then only picks up the documents that changed since. It
+uses a change stream where the server supports one (a replica set, e.g. Atlas). Otherwise it polls
+the updatedAt stamp the listener writes on every edit. A full resync every so often catches
+anything the fallback can't see (deleted documents, ones written without a stamp).
+
+The collection is passed in, so a local mongod or an in-memory stand-in with find (and optionally
+watch) works just as well. The watcher follows the watchList collection with it and levels.py the
+support/resistance levels.
+
+"""
+
+from pymongo.errors import PyMongoError
+
+
+class CollectionSync:
+    def __init__(self, collection, resync_every=360):
+        """
+        collection - the collection to follow
+        resync_every - how many polls between full reads of the collection
+        """
+        self.collection = collection
+        self.resync_every = resync_every
+        self.docs = {}
+        self.stream = None
+        self.since = None
+        self.polls = 0
+
+    def load(self):
+        """reads every document. The stream is opened first so nothing slips in between"""
+        self.stream = self._open_stream()
+        self.docs = {}
+        self._apply({doc["_id"]: doc for doc in self.collection.find({})})
+        return self.docs
+
+    def poll(self):
+        """
+        returns {_id: (old, new)} for each document that changed since the last poll. old is None
+        for a new document and new is None for a deleted one
+        """
+        self.polls += 1
+        if self.polls % self.resync_every == 0:
+            return self._resync()
+        if self.stream is not None:
+            try:
+                return self._drain()
+            except PyMongoError:
+                self.stream = None
+                return self._resync()
+        return self._changed_since()
+
+    def _open_stream(self):
+        try:
+            return self.collection.watch(full_document="updateLookup")
+        except (PyMongoError, AttributeError, NotImplementedError):
+            return None
+
+    def _drain(self):
+        """everything queued on the change stream, without waiting"""
+        changed = {}
+        while True:
+            change = self.stream.try_next()
+            if change is None:
+                return self._apply(changed)
+            if change["operationType"] in ["insert", "update", "replace", "delete"]:
+                changed[change["documentKey"]["_id"]] = change.get("fullDocument")
+
+    def _changed_since(self):
+        """the documents stamped at or after the newest stamp seen so far"""
+        if self.since is None:
+            query = {"updatedAt": {"$exists": True}}
+        else:
+            query = {"updatedAt": {"$gte": self.since}}
+        return self._apply({doc["_id"]: doc for doc in self.collection.find(query)})
+
+    def _resync(self):
+        """a full read, diffed against what we have (and another go at opening a stream)"""
+        if self.stream is None:
+            self.stream = self._open_stream()
+        docs = {doc["_id"]: doc for doc in self.collection.find({})}
+        docs.update({key: None for key in self.docs if key not in docs})
+        return self._apply(docs)
+
+    def _apply(self, docs):
+        """takes {_id: doc or None}, keeps the ones that really changed and returns their diffs"""
+        changes = {}
+        for key, doc in docs.items():
+            old = self.docs.get(key)
+            if doc == old:
+                continue
+            changes[key] = (old, doc)
+            if doc is None:
+                del self.docs[key]
+            else:
+                self.docs[key] = doc
+                if doc.get("updatedAt") is not None and (
+                    self.since is None or doc["updatedAt"] > self.since
+                ):
+                    self.since = doc["updatedAt"]
+        return changes
@@ -0,0 +1,46 @@
+"""
+Trades as structured numpy arrays.
+
+A poll's trades are held in one structured array rather than a DataFrame. Only the current batch
+is kept per market - the counts carry everything the watcher needs from older trades - and the
+cursor filter and the sort hand back views where they can, so a poll allocates its batch once.
+
+"""
+
+import numpy as np
+
+TRADE_DTYPE = np.dtype(
+    [
+        ("id", np.int64),
+        ("time", np.int64),  # epoch ns
+        ("price", np.float64),
+        ("size", np.float64),
+        ("dollar", np.float64),
+        ("side", np.int8),  # 1 buy, -1 sell
+        ("liquidation", np.bool_),
+    ]
+)
+
+
+def to_trades(id, time, price, size, side, liquidation):
+    """builds a structured trade array (sorted by time then id) from columns"""
+    trades = np.empty(len(id), dtype=TRADE_DTYPE)
+    trades["id"] = id
+    trades["time"] = time
+    trades["price"] = price
+    trades["size"] = size
+    trades["dollar"] = trades["size"] * trades["price"]
+    trades["side"] = side
+    trades["liquidation"] = liquidation
+    # ftx sends its trades newest first, so a reversed view is usually all the sorting needed
+    if _ordered(trades):
+        return trades
+    if _ordered(trades[::-1]):
+        return trades[::-1]
+    return trades[np.lexsort((trades["id"], trades["time"]))]
+
+
+def _ordered(trades):
+    """whether the trades are already sorted by time then id"""
+    time, id = trades["time"], trades["id"]
+    return bool(((time[1:] > time[:-1]) | ((time[1:] == time[:-1]) & (id[1:] >= id[:-1]))).all())